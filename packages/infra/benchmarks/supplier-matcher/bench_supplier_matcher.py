@@ -0,0 +1,343 @@
+"""
+Reproducible benchmark for the supplier matcher Lambda.
+
+Generates synthetic supplier lists and noisy vendor-name queries from a fixed seed,
+serves them from an in-memory S3 stand-in, and measures:
+
+    load_csv      stream and parse SupplierList.csv, build the normalized/trigram index
+    load_index    load the prebuilt SupplierList.index.json.gz (HEAD + GET)
+    single_match  one find_best_match call per query
+    batch_match   match_vendors_batch over a batch of queries
+
+Each scenario reports throughput, p50/p99 latency, peak traced memory and, for the
+matching scenarios, top-1 accuracy against the supplier each query was derived from.
+Results can be saved as a baseline and later runs compared against it.
+
+Usage (offline, no AWS credentials needed):
+    python bench_supplier_matcher.py [--sizes 1000,10000,100000] [--queries 200] \\
+        [--batch-size 1000] [--seed 7] [--output results.json] \\
+        [--save-baseline baselines/local.json] [--compare baselines/local.json] \\
+        [--tolerance 0.1] [--fail-on-regression]
+
+Sizes up to 1000000 rows are supported; expect the largest lists to take minutes.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+INFRA_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+sys.path.insert(0, os.path.join(INFRA_DIR, 'lambda', 'supplier-matcher'))
+sys.path.insert(0, os.path.join(INFRA_DIR, 'lambda', 'python', 'pipeline-metrics-layer', 'python'))
+
+# Keep the Lambda's EMF lines and INFO logs out of the benchmark output and timings
+os.environ.setdefault('PIPELINE_METRICS_ENABLED', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import numpy as np  # noqa: E402
+import rapidfuzz  # noqa: E402
+
+import index  # noqa: E402
+from in_memory_s3 import InMemoryS3  # noqa: E402
+
+BUCKET = 'benchmark-bucket'
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ter', 'van', 'dor', 'sen', 'ra', 'bel', 'tor', 'nik', 'ash',
+             'po', 'lin', 'qua', 'zen', 'mar', 'el', 'fin', 'gro', 'hal', 'jun', 'kel', 'os']
+INDUSTRIES = ['Trading', 'Logistics', 'Engineering', 'Holdings', 'Foods', 'Textiles', 'Electronics',
+              'Construction', 'Consulting', 'Pharma', 'Printing', 'Marine', 'Software', 'Metals',
+              'Packaging', 'Travel', 'Security', 'Furniture', 'Energy', 'Supplies']
+SUFFIXES = ['Ltd', 'Limited', 'Inc', 'Co', 'Company', 'Corp', 'Corporation', 'LLC', 'Pte Ltd', 'GmbH']
+# Spellings a vendor name on an invoice may use instead of the supplier list's suffix
+SUFFIX_VARIANTS = {
+    'Ltd': ['Limited', 'Ltd.', 'LTD'], 'Limited': ['Ltd', 'Ltd.'], 'Inc': ['Incorporated', 'Inc.'],
+    'Co': ['Company', 'Co.'], 'Company': ['Co', 'Co.'], 'Corp': ['Corporation', 'Corp.'],
+    'Corporation': ['Corp', 'Corp.'], 'LLC': ['L.L.C.', 'llc'], 'Pte Ltd': ['Pte. Ltd.', 'Private Limited'],
+    'GmbH': ['Gmbh', 'G.m.b.H.']
+}
+
+CSV_HEADER = 'supplier_code,name_1,name_2,group_1,group_2,cr_1,cr_2,aws_vendor\n'
+
+
+def make_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+
+def generate_suppliers(size, rng):
+    """Unique (supplier_code, name_1, name_2) rows shaped like a real supplier list"""
+    seen = set()
+    suppliers = []
+    while len(suppliers) < size:
+        name_1 = f"{make_word(rng)} {make_word(rng)} {rng.choice(INDUSTRIES)}"
+        name_2 = rng.choice(SUFFIXES)
+        if (name_1, name_2) in seen:
+            continue
+        seen.add((name_1, name_2))
+        suppliers.append((f"S{len(suppliers):07d}", name_1, name_2))
+    return suppliers
+
+
+def supplier_csv(suppliers):
+    lines = [CSV_HEADER]
+    for i, (code, name_1, name_2) in enumerate(suppliers):
+        lines.append(f"{code},{name_1},{name_2},G{i % 17},,CR{i},,Vendor {i}\n")
+    return ''.join(lines)
+
+
+def typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(['delete', 'substitute', 'transpose'])
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    if kind == 'substitute':
+        return word[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + word[i + 1:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def noisy_vendor_name(name_1, name_2, rng):
+    """Vendor name as BDA might extract it from an invoice: suffix variants, typos, case and order noise"""
+    tokens = name_1.split()
+    suffix = name_2
+    for _ in range(rng.randint(1, 3)):
+        noise = rng.choice(['suffix', 'drop_suffix', 'typo', 'case', 'swap', 'punctuation'])
+        if noise == 'suffix':
+            suffix = rng.choice(SUFFIX_VARIANTS.get(suffix, [suffix]))
+        elif noise == 'drop_suffix':
+            suffix = ''
+        elif noise == 'typo':
+            i = rng.randrange(len(tokens))
+            tokens[i] = typo(tokens[i], rng)
+        elif noise == 'case':
+            tokens = [t.upper() if rng.random() < 0.5 else t.lower() for t in tokens]
+        elif noise == 'swap' and len(tokens) > 1:
+            i = rng.randrange(len(tokens) - 1)
+            tokens[i], tokens[i + 1] = tokens[i + 1], tokens[i]
+        elif noise == 'punctuation':
+            tokens[-1] += ','
+    return ' '.join(tokens + ([suffix] if suffix else []))
+
+
+def generate_queries(suppliers, count, rng):
+    picks = [rng.randrange(len(suppliers)) for _ in range(count)]
+    return [(noisy_vendor_name(suppliers[i][1], suppliers[i][2], rng), suppliers[i][0]) for i in picks]
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def latency_stats(latencies_ms, operations, elapsed_seconds):
+    return {
+        'operations': operations,
+        'throughput_per_s': round(operations / elapsed_seconds, 2) if elapsed_seconds > 0 else None,
+        'p50_ms': percentile(latencies_ms, 50),
+        'p99_ms': percentile(latencies_ms, 99)
+    }
+
+
+def peak_memory_mb(fn):
+    """Peak traced allocation of one extra, untimed run (tracing slows the code down too much to time it)"""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 2)
+
+
+def timed_runs(fn, repeat):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    return latencies, time.perf_counter() - start
+
+
+def top1_accuracy(best_matches, expected_codes):
+    correct = sum(1 for match, code in zip(best_matches, expected_codes) if match and match['supplier_code'] == code)
+    return round(correct / len(expected_codes), 4) if expected_codes else None
+
+
+def bench_size(size, args, s3):
+    rng = random.Random(f"{args.seed}-{size}")
+    suppliers = generate_suppliers(size, rng)
+    queries = generate_queries(suppliers, args.queries, rng)
+    batch = generate_queries(suppliers, args.batch_size, rng)
+
+    csv_key = f"bench-{size}/{index.SUPPLIER_LIST_KEY}"
+    s3.put_object(Bucket=BUCKET, Key=csv_key, Body=supplier_csv(suppliers))
+    results = {}
+
+    # load_csv: the cold path when no prebuilt index exists
+    def load_csv():
+        matcher = index.SupplierMatcher()
+        assert matcher.load_suppliers_from_s3(BUCKET, csv_key)
+        return matcher
+
+    latencies, elapsed = timed_runs(load_csv, args.load_repeat)
+    results['load_csv'] = {**latency_stats(latencies, args.load_repeat, elapsed),
+                           'suppliers_per_s': round(size * args.load_repeat / elapsed, 2)}
+    if args.memory:
+        results['load_csv']['peak_mb'] = peak_memory_mb(load_csv)
+
+    matcher = load_csv()
+    s3.put_object(Bucket=BUCKET, Key=index.supplier_index_key(csv_key), Body=matcher.to_index_bytes(),
+                  Metadata={'source-etag': matcher.etag})
+
+    # load_index: the usual cold start once the index builder has run
+    def load_index():
+        loaded = index.SupplierMatcher()
+        assert loaded.load_suppliers(BUCKET, csv_key)
+        return loaded
+
+    latencies, elapsed = timed_runs(load_index, args.load_repeat)
+    results['load_index'] = {**latency_stats(latencies, args.load_repeat, elapsed),
+                             'suppliers_per_s': round(size * args.load_repeat / elapsed, 2)}
+    if args.memory:
+        results['load_index']['peak_mb'] = peak_memory_mb(load_index)
+
+    # Warm up rapidfuzz's thread pool before timing matches
+    for vendor_name, _ in queries[:5]:
+        matcher.find_best_match(vendor_name)
+    matcher.match_cache.entries.clear()
+
+    best_matches = []
+    latencies = []
+    start = time.perf_counter()
+    for vendor_name, _ in queries:
+        call_start = time.perf_counter()
+        best_matches.append(matcher.find_best_match(vendor_name))
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    results['single_match'] = {**latency_stats(latencies, len(queries), time.perf_counter() - start),
+                               'top1_accuracy': top1_accuracy(best_matches, [code for _, code in queries])}
+    if args.memory:
+        # queries[0] was just matched, so clear the cache to measure scoring rather than a cache lookup
+        matcher.match_cache.entries.clear()
+        results['single_match']['peak_mb'] = peak_memory_mb(lambda: matcher.find_best_match(queries[0][0]))
+
+    vendor_names = [vendor_name for vendor_name, _ in batch]
+    batch_results = []
+
+    def match_batch():
+        # Repeats would otherwise be served from the match cache instead of scored
+        matcher.match_cache.entries.clear()
+        batch_results.append(index.match_vendors_batch(matcher, vendor_names, []))
+
+    latencies, elapsed = timed_runs(match_batch, args.batch_repeat)
+    batch_best = [result['best_match'] for result in batch_results[-1]['results']]
+    results['batch_match'] = {**latency_stats(latencies, args.batch_repeat, elapsed),
+                              'vendors_per_s': round(len(vendor_names) * args.batch_repeat / elapsed, 2),
+                              'top1_accuracy': top1_accuracy(batch_best, [code for _, code in batch])}
+    if args.memory:
+        results['batch_match']['peak_mb'] = peak_memory_mb(match_batch)
+
+    return results
+
+
+# Metrics compared against a baseline, and whether a larger value is an improvement
+COMPARED_METRICS = {
+    'throughput_per_s': True,
+    'suppliers_per_s': True,
+    'vendors_per_s': True,
+    'top1_accuracy': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'peak_mb': False
+}
+
+
+def compare(current, baseline, tolerance):
+    """Print per-metric changes against the baseline; returns the regressions beyond tolerance"""
+    regressions = []
+    for size, scenarios in current['results'].items():
+        for scenario, values in scenarios.items():
+            base_values = baseline.get('results', {}).get(size, {}).get(scenario)
+            if not base_values:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                new, old = values.get(metric), base_values.get(metric)
+                if new is None or not old:
+                    continue
+                change = (new - old) / old
+                worse = -change if higher_is_better else change
+                # Accuracy is deterministic for a seed, so any drop counts
+                limit = 0 if metric == 'top1_accuracy' else tolerance
+                flag = 'REGRESSION' if worse > limit else ''
+                print(f"{size:>8} {scenario:<13} {metric:<17} {old:>12} -> {new:>12} {change:+8.1%} {flag}")
+                if flag:
+                    regressions.append((size, scenario, metric, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark supplier list loading and vendor matching")
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma-separated supplier list sizes")
+    parser.add_argument('--queries', type=int, default=200, help="Single-match queries per size")
+    parser.add_argument('--batch-size', type=int, default=1000, help="Vendors per match_vendors_batch call")
+    parser.add_argument('--batch-repeat', type=int, default=3)
+    parser.add_argument('--load-repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="Skip the traced peak-memory runs")
+    parser.add_argument('--output', help="Write results JSON here")
+    parser.add_argument('--save-baseline', help="Write results JSON as a baseline for later --compare runs")
+    parser.add_argument('--compare', help="Baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed relative slowdown before flagging")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    s3 = InMemoryS3()
+    index.s3_client = s3
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rapidfuzz': rapidfuzz.__version__,
+            'numpy': np.__version__,
+            'seed': args.seed,
+            'queries': args.queries,
+            'batch_size': args.batch_size
+        },
+        'results': {}
+    }
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f"Benchmarking {size} suppliers...", flush=True)
+        report['results'][str(size)] = bench_size(size, args, s3)
+        print(json.dumps(report['results'][str(size)], indent=2), flush=True)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('platform') != report['meta']['platform']:
+            print("Warning: baseline was recorded on a different platform, timings may not be comparable")
+        regressions = compare(report, baseline, args.tolerance)
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+        if regressions and args.fail_on_regression:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
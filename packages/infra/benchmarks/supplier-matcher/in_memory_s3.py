@@ -0,0 +1,62 @@
+"""
+In-memory stand-in for the parts of the boto3 S3 client the supplier matcher uses.
+
+Bodies are real botocore StreamingBody objects, so iter_lines/read behave exactly as
+they do against S3 and the benchmark exercises the production streaming code path.
+"""
+import datetime
+import hashlib
+import io
+
+from botocore.response import StreamingBody
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class _Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+class InMemoryS3:
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = {'get_object': 0, 'head_object': 0, 'put_object': 0}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.requests['put_object'] += 1
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        self.objects[(Bucket, Key)] = {
+            'data': data,
+            'ETag': etag,
+            'LastModified': datetime.datetime.now(datetime.timezone.utc),
+            'Metadata': dict(Metadata or {})
+        }
+        return {'ETag': etag}
+
+    def _object(self, Bucket, Key):
+        try:
+            return self.objects[(Bucket, Key)]
+        except KeyError:
+            raise NoSuchKey(f"s3://{Bucket}/{Key}") from None
+
+    def _headers(self, obj):
+        return {
+            'ETag': obj['ETag'],
+            'LastModified': obj['LastModified'],
+            'ContentLength': len(obj['data']),
+            'Metadata': obj['Metadata']
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.requests['head_object'] += 1
+        return self._headers(self._object(Bucket, Key))
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.requests['get_object'] += 1
+        obj = self._object(Bucket, Key)
+        return {**self._headers(obj), 'Body': StreamingBody(io.BytesIO(obj['data']), len(obj['data']))}
@@ -0,0 +1,150 @@
+"""
+Re-run Bedrock Data Automation over documents already in S3, e.g. after a blueprint change.
+
+Lists a document prefix, skips documents that already have a bda-result/*-result.json,
+and submits BDA jobs with a bounded number in flight and a submission rate limit.
+Per-document outcomes are written to a state file so an interrupted run can resume.
+
+The backfill aggregates each job's output itself, so its jobs are submitted without the
+EventBridge completion event that would have the BDA lambda process the same output again.
+
+Usage (the shared metrics layer must be importable):
+    PYTHONPATH=../pipeline-metrics-layer/python python backfill.py --bucket <data-bucket> --blueprint-arn <arn> --account-id <id> \\
+        [--prefix datasets/documents] [--concurrency 4] [--rate 1.0] \\
+        [--state-file backfill-state.json] [--force] [--dry-run]
+"""
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import index_bda_call
+from submission_governor import SubmissionGovernor
+
+DOCUMENTS_PREFIX = "datasets/documents"
+RESULTS_PREFIX = "bda-result/"
+
+
+class BackfillProgress:
+    # Per-document outcomes persisted as JSON so an interrupted backfill can resume
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.documents = {}
+        self.lock = threading.Lock()
+        if state_file and os.path.exists(state_file):
+            with open(state_file, encoding='utf-8') as f:
+                self.documents = json.load(f).get('documents', {})
+
+    def is_done(self, key):
+        return self.documents.get(key, {}).get('status') == 'done'
+
+    def record(self, key, outcome):
+        with self.lock:
+            self.documents[key] = outcome
+            if self.state_file:
+                # Write then rename so a crash never leaves a truncated state file
+                tmp_file = f"{self.state_file}.tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump({'documents': self.documents}, f, indent=2)
+                os.replace(tmp_file, self.state_file)
+
+
+def list_keys(bucket, prefix):
+    paginator = index_bda_call.s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/'):
+                yield obj['Key']
+
+
+def process_document(bucket, key, blueprint_arn, governor, job_timeout):
+    targetkey_raw, targetkey_processed = index_bda_call.get_target_keys(key)
+
+    output_s3_uri_raw = f"s3://{bucket}/{targetkey_raw}"
+    response = index_bda_call.invoke_insight_generation_async(
+        f"s3://{bucket}/{key}", output_s3_uri_raw, blueprint_arn, governor, notify_on_completion=False)
+
+    status_response = index_bda_call.wait_for_insight_generation(response, job_timeout)
+    if status_response['status'] != 'Success':
+        return {
+            'status': 'failed',
+            'invocationArn': response['invocationArn'],
+            'errorType': status_response.get('errorType'),
+            'errorMessage': status_response.get('errorMessage')
+        }
+
+    # Earlier runs of the document sit in sibling job folders under the same raw prefix
+    job_output_s3_uri = index_bda_call.job_output_uri(output_s3_uri_raw, response['invocationArn'], status_response)
+    result_uri = index_bda_call.process_bda_output(job_output_s3_uri, targetkey_processed)
+    if not result_uri:
+        return {'status': 'failed', 'invocationArn': response['invocationArn'], 'errorMessage': 'No BDA output to aggregate'}
+
+    return {'status': 'done', 'invocationArn': response['invocationArn'], 'result': result_uri}
+
+
+def run_backfill(bucket, blueprint_arn, prefix=DOCUMENTS_PREFIX, concurrency=4, rate=1.0,
+                 state_file=None, force=False, dry_run=False, job_timeout=900):
+    progress = BackfillProgress(state_file)
+    existing_results = set() if force else set(list_keys(bucket, RESULTS_PREFIX))
+
+    pending = []
+    skipped = 0
+    for key in list_keys(bucket, prefix):
+        if progress.is_done(key) or index_bda_call.get_target_keys(key)[1] in existing_results:
+            skipped += 1
+        else:
+            pending.append(key)
+
+    print(f"Backfill: {len(pending)} documents to process, {skipped} already have results")
+    summary = {'pending': len(pending), 'skipped': skipped, 'done': 0, 'failed': 0}
+    if dry_run or not pending:
+        return summary
+
+    # Throttled submissions back off and retry for up to a minute before the document is marked failed
+    governor = SubmissionGovernor(rate, burst=1, max_in_flight=concurrency, deadline_seconds=60)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(process_document, bucket, key, blueprint_arn, governor, job_timeout): key
+            for key in pending
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            key = futures[future]
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = {'status': 'failed', 'errorMessage': str(e)}
+
+            progress.record(key, outcome)
+            summary[outcome['status']] += 1
+            print(f"[{completed}/{len(pending)}] {key}: {outcome['status']}")
+
+    print(f"Backfill finished: {summary}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run BDA over existing documents at a controlled rate")
+    parser.add_argument('--bucket', default=index_bda_call.TARGET_BUCKET_NAME, required=not index_bda_call.TARGET_BUCKET_NAME)
+    parser.add_argument('--blueprint-arn', default=index_bda_call.CUSTOM_BLUEPRINT_ARN, required=not index_bda_call.CUSTOM_BLUEPRINT_ARN)
+    parser.add_argument('--account-id', default=index_bda_call.ACCOUNT_ID, required=not index_bda_call.ACCOUNT_ID)
+    parser.add_argument('--prefix', default=DOCUMENTS_PREFIX)
+    parser.add_argument('--concurrency', type=int, default=4, help="Max BDA jobs in flight")
+    parser.add_argument('--rate', type=float, default=1.0, help="Max job submissions per second")
+    parser.add_argument('--job-timeout', type=float, default=900, help="Seconds to wait for each job")
+    parser.add_argument('--state-file', default='backfill-state.json', help="Progress file used to resume")
+    parser.add_argument('--force', action='store_true', help="Reprocess documents that already have results")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be processed")
+    args = parser.parse_args(argv)
+
+    # The BDA profile ARN in the invoke payload is built from ACCOUNT_ID
+    index_bda_call.ACCOUNT_ID = args.account_id
+
+    summary = run_backfill(
+        args.bucket, args.blueprint_arn, prefix=args.prefix, concurrency=args.concurrency, rate=args.rate,
+        state_file=args.state_file, force=args.force, dry_run=args.dry_run, job_timeout=args.job_timeout)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
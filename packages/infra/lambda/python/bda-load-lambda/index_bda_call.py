@@ -1,16 +1,65 @@
 import os
 import boto3
-import cfnresponse
 import logging
 import json
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
+from pipeline_metrics import PipelineMetrics
+from job_ledger import (
+    IN_FLIGHT, JobLedger, S3JobLedgerStore, document_content_hash, invocation_job_id, ledger_entry_key
+)
+from submission_governor import SubmissionCapacity, SubmissionDeferred, SubmissionGovernor
 
 TARGET_BUCKET_NAME = os.environ.get('TARGET_BUCKET_NAME', None)
 # Use the environment variable for the project ARN
 DATA_PROJECT_ARN = os.environ.get('DATA_PROJECT_ARN', None)
 ACCOUNT_ID = os.environ.get('ACCOUNT_ID', None)
 CUSTOM_BLUEPRINT_ARN = os.environ.get('CUSTOM_BLUEPRINT_ARN', None)
+# Fingerprint of the deployed blueprint schema; a new one stops the job ledger reusing results from the old schema
+CUSTOM_BLUEPRINT_VERSION = os.environ.get('CUSTOM_BLUEPRINT_VERSION', '')
+CUSTOM_BLUEPRINT_STAGE = 'LIVE'
+
+# Poll inside the invocation instead of waiting for the BDA EventBridge completion event
+BDA_WAIT_FOR_COMPLETION = os.environ.get('BDA_WAIT_FOR_COMPLETION', 'false').lower() == 'true'
+
+# Exponential backoff and overall deadline for polling get_data_automation_status
+BDA_POLL_INITIAL_DELAY_SECONDS = float(os.environ.get('BDA_POLL_INITIAL_DELAY_SECONDS', '2'))
+BDA_POLL_MAX_DELAY_SECONDS = float(os.environ.get('BDA_POLL_MAX_DELAY_SECONDS', '30'))
+BDA_POLL_DEADLINE_SECONDS = float(os.environ.get('BDA_POLL_DEADLINE_SECONDS', '240'))
+
+# Parallel downloads of custom_output result.json files when aggregating BDA output
+BDA_OUTPUT_FETCH_WORKERS = int(os.environ.get('BDA_OUTPUT_FETCH_WORKERS', '8'))
+
+# Only read the first result segment, for callers that just need the leading document
+BDA_OUTPUT_FIRST_ONLY = os.environ.get('BDA_OUTPUT_FIRST_ONLY', 'false').lower() == 'true'
+
+# Content-hash job ledger that stops identical documents from being processed twice
+BDA_LEDGER_ENABLED = os.environ.get('BDA_LEDGER_ENABLED', 'true').lower() == 'true'
+BDA_LEDGER_PREFIX = os.environ.get('BDA_LEDGER_PREFIX', 'bda-ledger/')
+# In-flight entries older than this are assumed lost and resubmitted
+BDA_LEDGER_IN_FLIGHT_TTL_SECONDS = float(os.environ.get('BDA_LEDGER_IN_FLIGHT_TTL_SECONDS', '3600'))
+# Claims with no invocation ARN older than this were abandoned before submitting; keep it above the function timeout
+BDA_LEDGER_SUBMIT_GRACE_SECONDS = float(os.environ.get('BDA_LEDGER_SUBMIT_GRACE_SECONDS', '600'))
+
+# How long a throttled submission keeps retrying before the event is handed back for a Lambda retry
+BDA_SUBMIT_RETRY_DEADLINE_SECONDS = float(os.environ.get('BDA_SUBMIT_RETRY_DEADLINE_SECONDS', '60'))
+
+# Submission limits shared by every concurrent invocation, set from the stack parameters; 0 disables a limit
+BDA_SUBMIT_RATE_PER_SECOND = float(os.environ.get('BDA_SUBMIT_RATE_PER_SECOND', '0'))
+BDA_SUBMIT_BURST = int(os.environ.get('BDA_SUBMIT_BURST', '1'))
+BDA_MAX_JOBS_IN_FLIGHT = int(os.environ.get('BDA_MAX_JOBS_IN_FLIGHT', '0'))
+# How long an upload waits in the invocation for a rate token before it is handed back to the upload queue
+BDA_CAPACITY_WAIT_SECONDS = float(os.environ.get('BDA_CAPACITY_WAIT_SECONDS', '10'))
+# When every in-flight slot is taken, the upload message becomes visible again after about this long
+BDA_CAPACITY_RETRY_SECONDS = float(os.environ.get('BDA_CAPACITY_RETRY_SECONDS', '60'))
+
+# Queue that buffers upload events until there is capacity to submit them
+UPLOAD_QUEUE_URL = os.environ.get('UPLOAD_QUEUE_URL', None)
+
+# EventBridge detail-type BDA emits when a job finishes successfully
+BDA_JOB_SUCCEEDED = 'Bedrock Data Automation Job Succeeded'
 
 config = Config(
     retries = dict(
@@ -21,12 +70,41 @@ config = Config(
 
 s3 = boto3.client("s3")
 bda = boto3.client("bedrock-data-automation-runtime", config=config)
+sqs = boto3.client("sqs")
+
+metrics = PipelineMetrics('bda-load')
+
+# An execution environment handles one event at a time, so a per-process rate or in-flight limit would never
+# bind; only the throttle backoff applies here. The shared SubmissionCapacity below enforces the limits
+submission_governor = SubmissionGovernor(0, deadline_seconds=BDA_SUBMIT_RETRY_DEADLINE_SECONDS)
+
+ledger = None
+if BDA_LEDGER_ENABLED and TARGET_BUCKET_NAME:
+    ledger = JobLedger(
+        S3JobLedgerStore(s3, TARGET_BUCKET_NAME, BDA_LEDGER_PREFIX),
+        BDA_LEDGER_IN_FLIGHT_TTL_SECONDS,
+        BDA_LEDGER_SUBMIT_GRACE_SECONDS
+    )
+
+# Jobs that never report completion give their slot back after the ledger's in-flight TTL
+capacity = None
+if TARGET_BUCKET_NAME and (BDA_SUBMIT_RATE_PER_SECOND > 0 or BDA_MAX_JOBS_IN_FLIGHT > 0):
+    capacity = SubmissionCapacity(
+        S3JobLedgerStore(s3, TARGET_BUCKET_NAME, BDA_LEDGER_PREFIX),
+        BDA_SUBMIT_RATE_PER_SECOND,
+        burst=BDA_SUBMIT_BURST,
+        max_in_flight=BDA_MAX_JOBS_IN_FLIGHT,
+        slot_ttl_seconds=BDA_LEDGER_IN_FLIGHT_TTL_SECONDS,
+        full_retry_seconds=BDA_CAPACITY_RETRY_SECONDS
+    )
 
 
 def invoke_insight_generation_async(
         input_s3_uri,
         output_s3_uri,
-        custom_blueprint_arn):
+        custom_blueprint_arn,
+        governor=None,
+        notify_on_completion=True):
 
     payload = {
         "inputConfiguration": {
@@ -38,77 +116,130 @@ def invoke_insight_generation_async(
         "blueprints": [
             {
                 "blueprintArn": custom_blueprint_arn,
-                "stage": "LIVE"
+                "stage": CUSTOM_BLUEPRINT_STAGE
             }
         ],
         "dataAutomationProfileArn": f"arn:aws:bedrock:us-east-1:{str(ACCOUNT_ID)}:data-automation-profile/us.data-automation-v1",
         "notificationConfiguration": {
-        "eventBridgeConfiguration": {"eventBridgeEnabled": True},
+        # Callers that process the output themselves turn the completion event off so it is not handled twice
+        "eventBridgeConfiguration": {"eventBridgeEnabled": notify_on_completion},
         }
     }
     print(payload)
 
-    response = bda.invoke_data_automation_async(**payload)
+    with metrics.stage('BdaSubmit'):
+        response = (governor or submission_governor).submit(bda.invoke_data_automation_async, **payload)
+    metrics.count('BdaJobsSubmitted')
+    print(response)
+    return response
+
+
+@metrics.timed('BdaWait')
+def wait_for_insight_generation(response, deadline_seconds=BDA_POLL_DEADLINE_SECONDS):
     invocation_arn = response['invocationArn']
-    while bda.get_data_automation_status(invocationArn=invocation_arn)['status'] != 'Success': 
-        print('Project status: %s', bda.get_data_automation_status(invocationArn=invocation_arn)['status'])
-        if bda.get_data_automation_status(invocationArn=invocation_arn)['status'] in ['ServiceError', 'ClientError']:
-                print(f"Job failed with status: {status}")
-                print(f"Error type: {response.get('errorType')}")
-                print(f"Error message: {response.get('errorMessage')}")
-                return False
-        # Intentional 5-second delay between API calls to prevent rate limiting
+    deadline = time.monotonic() + deadline_seconds
+    delay = BDA_POLL_INITIAL_DELAY_SECONDS
+
+    while True:
+        # One status call per iteration; the same response drives logging and the failure check
+        status_response = bda.get_data_automation_status(invocationArn=invocation_arn)
+        metrics.count('BdaStatusPolls')
+        status = status_response['status']
+        print(f"Project status: {status}")
+
+        if status == 'Success':
+            return status_response
+
+        if status in ['ServiceError', 'ClientError']:
+            print(f"Job failed with status: {status}")
+            print(f"Error type: {status_response.get('errorType')}")
+            print(f"Error message: {status_response.get('errorMessage')}")
+            return status_response
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"Timed out waiting for BDA job {invocation_arn}, last status: {status}")
+            return {
+                'status': 'Timeout',
+                'errorType': 'Timeout',
+                'errorMessage': f"BDA job still {status} after {deadline_seconds:.0f}s"
+            }
+
+        # Exponential backoff with jitter keeps bursts of pollers from hitting the status API in lockstep
         # nosemgrep: arbitrary-sleep
-        time.sleep(5)
-        pass
+        time.sleep(min(delay / 2 + random.uniform(0, delay / 2), remaining))
+        delay = min(delay * 2, BDA_POLL_MAX_DELAY_SECONDS)
 
-    print(response)
-    return response
+
+def segment_sort_key(key):
+    # Order result files by job folder, then numerically by segment (custom_output/10 after custom_output/2)
+    head, _, tail = key.partition('/custom_output/')
+    segment = tail.split('/')[0]
+    return head, int(segment) if segment.isdigit() else 0
 
 
-def process_bda_output(output_s3_uri_raw, targetkey):
+@metrics.timed('S3List')
+def list_result_keys(bucket_name, prefix, first_only=False):
+    # Page through the raw output prefix for custom_output result files
+    result_keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/"):
+        for obj in page.get('Contents', []):
+            if 'custom_output' in obj['Key'] and obj['Key'].endswith('result.json'):
+                result_keys.append(obj['Key'])
+                if first_only:
+                    return result_keys
+
+    return sorted(result_keys, key=segment_sort_key)
+
+
+@metrics.timed('S3Get')
+def read_result_segment(bucket_name, key):
+    # Read the content of a result.json file and extract required fields
+    file_content = s3.get_object(Bucket=bucket_name, Key=key)['Body'].read().decode('utf-8')
+    json_content = json.loads(file_content)
+
+    return {
+        "matched_blueprint": json_content.get("matched_blueprint"),
+        "document_class": json_content.get("document_class"),
+        "inference_result": json_content.get("inference_result")
+    }
+
+
+@metrics.timed('OutputAggregation')
+def process_bda_output(output_s3_uri_raw, targetkey, first_only=False):
     # Parse the S3 URI
     bucket_name = output_s3_uri_raw.split('//')[1].split('/')[0]
     prefix = '/'.join(output_s3_uri_raw.split('//')[1].split('/')[1:])
     print(output_s3_uri_raw, targetkey)
     print(bucket_name, prefix)
-    aggregated_results = []
 
     try:
         # List all objects in the custom_output directory
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=f"{prefix}/")
+        result_keys = list_result_keys(bucket_name, prefix, first_only)
 
-        for obj in response.get('Contents', []):
-            if 'custom_output' in obj['Key'] and obj['Key'].endswith('result.json'):
-                # Read the content of each result.json file
-                file_content = s3.get_object(Bucket=bucket_name, Key=obj['Key'])['Body'].read().decode('utf-8')
-                json_content = json.loads(file_content)
-
-                # Extract required fields
-                extracted_data = {
-                    "matched_blueprint": json_content.get("matched_blueprint"),
-                    "document_class": json_content.get("document_class"),
-                    "inference_result": json_content.get("inference_result")
-                }
-
-                aggregated_results.append(extracted_data)
-
-        if not aggregated_results:
+        if not result_keys:
             print("No results found to process")
             return None
 
-        # Take the first result and convert it to JSON string
-        final_result = json.dumps(aggregated_results[0], indent=2)
+        # Fetch segments through a bounded pool; map keeps them in segment order
+        with ThreadPoolExecutor(max_workers=max(1, min(BDA_OUTPUT_FETCH_WORKERS, len(result_keys)))) as executor:
+            aggregated_results = list(executor.map(lambda key: read_result_segment(bucket_name, key), result_keys))
+        metrics.count('ResultFilesRead', len(aggregated_results))
+
+        # Keep the first segment at the top level for existing readers and attach every segment
+        final_result = json.dumps({**aggregated_results[0], "segments": aggregated_results}, indent=2)
 
         # Write the final result to S3
-        s3.put_object(
-            Bucket=bucket_name,
-            Key=targetkey,
-            Body=final_result,
-            ContentType='application/json'
-        )
-
-        print(f"Aggregated result written to s3://{bucket_name}/{targetkey}")
+        with metrics.stage('S3Put'):
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=targetkey,
+                Body=final_result,
+                ContentType='application/json'
+            )
+
+        print(f"Aggregated {len(aggregated_results)} segments written to s3://{bucket_name}/{targetkey}")
         return f"s3://{bucket_name}/{targetkey}"
 
     except Exception as e:
@@ -116,17 +247,221 @@ def process_bda_output(output_s3_uri_raw, targetkey):
         return None
 
 
+def get_target_keys(key):
+    # Raw BDA output prefix and processed result key for a document under datasets/documents
+    targetkey_raw = key.replace("datasets/documents", "bda-result-raw").split('.')[0]
+    targetkey_processed = key.replace("datasets/documents", "bda-result").split('.')[0].replace("_", "-")
+    return targetkey_raw, f"{targetkey_processed}-result.json"
+
+
+def job_output_uri(output_s3_uri_raw, invocation_arn, status_response=None):
+    # BDA writes each job under <output prefix>/<invocation id>/, so earlier runs of the document stay out of it
+    job_metadata_uri = (status_response or {}).get('outputConfiguration', {}).get('s3Uri')
+    if job_metadata_uri:
+        # The status response points at the job's job_metadata.json
+        return job_metadata_uri.rsplit('/', 1)[0] if job_metadata_uri.endswith('.json') else job_metadata_uri.rstrip('/')
+    return f"{output_s3_uri_raw}/{invocation_arn.rsplit('/', 1)[-1]}"
+
+
+def copy_result(source_key, target_key):
+    # Make an existing processed result available under another document's result key
+    try:
+        if source_key == target_key:
+            s3.head_object(Bucket=TARGET_BUCKET_NAME, Key=target_key)
+        else:
+            s3.copy_object(
+                Bucket=TARGET_BUCKET_NAME,
+                Key=target_key,
+                CopySource={'Bucket': TARGET_BUCKET_NAME, 'Key': source_key}
+            )
+        return True
+    except Exception as e:
+        print(f"Could not reuse result {source_key} for {target_key}: {str(e)}")
+        return False
+
+
+def document_ledger_key(bucket, key):
+    # Ledger entry for a document processed with the blueprint this function submits with
+    with metrics.stage('DocumentHash'):
+        content_hash = document_content_hash(s3, bucket, key)
+    return ledger_entry_key(content_hash, CUSTOM_BLUEPRINT_ARN, CUSTOM_BLUEPRINT_STAGE, CUSTOM_BLUEPRINT_VERSION)
+
+
+def record_ledger_outcome(entry_key, result_key, result_uri, error=None):
+    # Mark the ledger entry done, copying the result to duplicates that waited on it, or failed
+    if not ledger or not entry_key:
+        return
+
+    try:
+        if error or not result_uri:
+            ledger.fail(entry_key, error or "No BDA output to aggregate")
+            return
+
+        entry = ledger.complete(entry_key, result_key)
+        for waiting_key in entry.get('waiting_keys', []):
+            if copy_result(result_key, waiting_key):
+                print(f"Result copied to waiting duplicate s3://{TARGET_BUCKET_NAME}/{waiting_key}")
+    except Exception as e:
+        print(f"Error updating job ledger: {str(e)}")
+
+
+def job_ledger_pointer(job_id):
+    # Ledger entry key and submit time of a finished job, or {} for jobs the ledger did not start (e.g. backfill)
+    if not ledger or not job_id:
+        return {}
+
+    try:
+        pointer = ledger.job_pointer(invocation_job_id(job_id))
+    except Exception as e:
+        print(f"Error reading job ledger pointer for {job_id}: {str(e)}")
+        return {}
+    if not pointer:
+        print(f"No job ledger entry for BDA job {job_id}")
+    return pointer or {}
+
+
+def job_already_settled(entry_key, job_id):
+    # True when the entry was marked done or failed for this very job, not an earlier or later one
+    try:
+        entry = ledger.get(entry_key)
+    except Exception as e:
+        print(f"Error reading job ledger entry {entry_key}: {str(e)}")
+        return False
+    return bool(entry and entry['status'] != IN_FLIGHT and entry.get('invocationArn')
+                and invocation_job_id(entry['invocationArn']) == invocation_job_id(job_id))
+
+
+def acquire_submission_slot(slot_id):
+    # Short rate waits happen in the invocation; a full in-flight set hands the upload back to its queue
+    if not capacity:
+        return
+    with metrics.stage('CapacityWait'):
+        deadline = time.monotonic() + BDA_CAPACITY_WAIT_SECONDS
+        while True:
+            wait = capacity.acquire(slot_id)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise SubmissionDeferred(f"No BDA submission capacity for {slot_id}", wait)
+            time.sleep(wait)
+
+
+def release_submission_slot(slot_id):
+    if not capacity:
+        return
+    try:
+        capacity.release(slot_id)
+    except Exception as e:
+        print(f"Error releasing submission slot {slot_id}: {str(e)}")
+
+
+def requeue_upload_message(record, delay_seconds):
+    # A delayed copy rather than a failed receive, so waiting for capacity never counts towards the
+    # queue's redrive to the failed-events queue
+    sqs.send_message(
+        QueueUrl=UPLOAD_QUEUE_URL,
+        MessageBody=record['body'],
+        DelaySeconds=min(900, int(delay_seconds * random.uniform(1, 1.5)) + 1)
+    )
+
+
+def handle_bda_completion(event):
+    detail = event.get('detail', {})
+    job_id = detail.get('job_id')
+    input_object = detail.get('input_s3_object', {})
+    key = input_object.get('name', '')
+
+    # Only documents submitted by this pipeline have a result to write
+    if not key.startswith("datasets/documents"):
+        print(f"Ignoring BDA job {job_id} for s3://{input_object.get('s3_bucket')}/{key}")
+        return None
+
+    # The job no longer counts against the in-flight limit, whatever happens to its output
+    release_submission_slot(f"s3://{input_object.get('s3_bucket')}/{key}")
+
+    pointer = job_ledger_pointer(job_id)
+    entry_key = pointer.get('entry_key')
+    if entry_key and job_already_settled(entry_key, job_id):
+        # In polling mode the submitting invocation already aggregated the output and settled the entry
+        print(f"BDA job {job_id} was already processed by the invocation that submitted it")
+        return None
+
+    if pointer.get('submitted_at'):
+        # Polling mode times BdaWait around its status calls; here the job ran between two invocations
+        metrics.record_duration('BdaWait', (time.time() - pointer['submitted_at']) * 1000)
+
+    if event.get('detail-type') != BDA_JOB_SUCCEEDED:
+        print(f"BDA job {job_id} failed: {event.get('detail-type')}")
+        print(f"Error type: {detail.get('error_type')}")
+        print(f"Error message: {detail.get('error_message')}")
+        record_ledger_outcome(entry_key, None, None, error=event.get('detail-type'))
+        return {"error": event.get('detail-type'), "job_id": job_id}
+
+    targetkey_raw, targetkey_processed = get_target_keys(key)
+
+    # Only the job's own output folder, so earlier runs of the same document are not mixed in
+    output_location = detail.get('output_s3_location', {})
+    if output_location.get('s3_bucket') and output_location.get('name'):
+        output_s3_uri_raw = f"s3://{output_location['s3_bucket']}/{output_location['name'].rstrip('/')}"
+    elif job_id:
+        output_s3_uri_raw = job_output_uri(f"s3://{TARGET_BUCKET_NAME}/{targetkey_raw}", job_id)
+    else:
+        print(f"BDA completion event for {key} names no output location or job id")
+        record_ledger_outcome(entry_key, None, None, error="Missing output location")
+        return None
+
+    response_processed = process_bda_output(output_s3_uri_raw, targetkey_processed, BDA_OUTPUT_FIRST_ONLY)
+
+    if response_processed:
+        print(f"Processed output available at: {response_processed}")
+    else:
+        print("Failed to process BDA output")
+
+    record_ledger_outcome(entry_key, targetkey_processed, response_processed)
+    return response_processed
+
+
+def handle_upload_messages(event, context):
+    # Upload events buffered by the upload queue; failed messages are reported so only they are retried
+    failures = []
+    for record in event['Records']:
+        try:
+            handle_document_upload(json.loads(record['body']), context)
+        except SubmissionDeferred as e:
+            print(f"Deferring upload message {record['messageId']}: {str(e)}")
+            try:
+                requeue_upload_message(record, e.retry_after)
+            except Exception as requeue_error:
+                print(f"Error requeueing upload message {record['messageId']}: {str(requeue_error)}")
+                failures.append({"itemIdentifier": record['messageId']})
+        except Exception as e:
+            print(f"Upload message {record['messageId']} failed: {type(e).__name__}: {str(e)}")
+            failures.append({"itemIdentifier": record['messageId']})
+    return {"batchItemFailures": failures}
+
+
+@metrics.flush_after_invocation
 def lambda_handler(event, context):
     print(f"Received event: {event}")
 
+    # BDA job completion events are delivered to the same function by EventBridge
+    if event.get('source') == 'aws.bedrock':
+        return handle_bda_completion(event)
+
+    if 'Records' in event:
+        return handle_upload_messages(event, context)
+
+    return handle_document_upload(event, context)
+
+
+def handle_document_upload(event, context):
     bucket = event['detail']['bucket']['name']
     key = event['detail']['object']['key']
 
-    targetkey_raw = key.replace("datasets/documents", "bda-result-raw")
-    targetkey_processed = f"{key.replace("datasets/documents", "bda-result").split('.')[0].replace("_","-")}-result.json"
+    targetkey_raw, targetkey_processed = get_target_keys(key)
 
     input_s3_uri = f"s3://{bucket}/{key}"
-    output_s3_uri_raw = f"s3://{TARGET_BUCKET_NAME}/{targetkey_raw.split('.')[0]}"
+    output_s3_uri_raw = f"s3://{TARGET_BUCKET_NAME}/{targetkey_raw}"
 
     print(f"input_s3_uri: {input_s3_uri}")
     print(f"output_s3_uri: {output_s3_uri_raw}")
@@ -138,13 +473,84 @@ def lambda_handler(event, context):
     
     print(f"Using custom blueprint directly: {CUSTOM_BLUEPRINT_ARN}")
 
+    # Identical documents reuse an earlier or in-flight BDA job instead of paying for another run
+    entry_key = None
+    if ledger:
+        entry_key = document_ledger_key(bucket, key)
+        claimed, entry = ledger.claim(entry_key, key, targetkey_processed)
+
+        if not claimed and entry['status'] == IN_FLIGHT:
+            print(f"Identical document already in flight as {entry.get('invocationArn')}, result will be copied to {targetkey_processed}")
+            return {"deduplicated": True, "invocationArn": entry.get('invocationArn'), "ledgerKey": entry_key}
+
+        if not claimed:
+            if copy_result(entry['result_key'], targetkey_processed):
+                print(f"Reused existing result {entry['result_key']} for identical document")
+                return {"deduplicated": True, "result": f"s3://{TARGET_BUCKET_NAME}/{targetkey_processed}", "ledgerKey": entry_key}
+
+            # The earlier result is gone, so run the job again unless a concurrent duplicate already did
+            claimed, entry = ledger.restart(entry_key, key, targetkey_processed)
+            if not claimed:
+                print(f"Identical document resubmitted as {entry.get('invocationArn')}, result will be copied to {targetkey_processed}")
+                return {"deduplicated": True, "invocationArn": entry.get('invocationArn'), "ledgerKey": entry_key}
+
     # invoke insight generation
-    response = invoke_insight_generation_async(input_s3_uri, output_s3_uri_raw, CUSTOM_BLUEPRINT_ARN)
-    response_processed = process_bda_output(output_s3_uri_raw, targetkey_processed)
+    acquired = False
+    try:
+        acquire_submission_slot(input_s3_uri)
+        acquired = True
+        # Without a ledger the completion event could not tell a polled job was already processed, so polling
+        # mode then skips it; a job that outlives the poll deadline is reported as an error instead
+        response = invoke_insight_generation_async(
+            input_s3_uri, output_s3_uri_raw, CUSTOM_BLUEPRINT_ARN,
+            notify_on_completion=bool(ledger) or not BDA_WAIT_FOR_COMPLETION)
+    except Exception as e:
+        print(f"BDA submission for {key} failed: {type(e).__name__}: {str(e)}")
+        if acquired:
+            release_submission_slot(input_s3_uri)
+        if ledger:
+            # Release the claim, or the retried event would be deduplicated against a job that was never submitted
+            try:
+                ledger.fail(entry_key, f"SubmitFailed: {type(e).__name__}")
+            except Exception as ledger_error:
+                print(f"Error releasing job ledger claim: {str(ledger_error)}")
+        # Raising hands the event back for a retry, then to the failed-events queue, instead of dropping the document
+        raise
+    if ledger:
+        ledger.record_submission(entry_key, response['invocationArn'])
+
+    if not BDA_WAIT_FOR_COMPLETION:
+        # Return right away; the BDA completion event triggers process_bda_output
+        print(f"Submitted BDA job {response['invocationArn']}, {targetkey_processed} will be written on completion")
+        return response
+
+    # Leave headroom in the invocation to aggregate the output after the job finishes
+    deadline_seconds = BDA_POLL_DEADLINE_SECONDS
+    if context is not None:
+        deadline_seconds = min(deadline_seconds, context.get_remaining_time_in_millis() / 1000 - 30)
+
+    status_response = wait_for_insight_generation(response, deadline_seconds)
+    if status_response['status'] != 'Timeout':
+        # A timed-out job keeps its slot until its completion event arrives
+        release_submission_slot(input_s3_uri)
+    if status_response['status'] != 'Success':
+        if status_response['status'] != 'Timeout':
+            # A timed-out job is still running and its completion event settles the ledger entry
+            record_ledger_outcome(entry_key, None, None, error=status_response.get('errorType') or status_response['status'])
+        return {
+            "error": f"BDA job did not succeed: {status_response['status']}",
+            "invocationArn": response['invocationArn'],
+            "errorType": status_response.get('errorType'),
+            "errorMessage": status_response.get('errorMessage')
+        }
+
+    job_output_s3_uri = job_output_uri(output_s3_uri_raw, response['invocationArn'], status_response)
+    response_processed = process_bda_output(job_output_s3_uri, targetkey_processed, BDA_OUTPUT_FIRST_ONLY)
 
     if response_processed:
         print(f"Processed output available at: {response_processed}")
     else:
         print("Failed to process BDA output")
-        
-    return response
\ No newline at end of file
+
+    record_ledger_outcome(entry_key, targetkey_processed, response_processed)
+    return response
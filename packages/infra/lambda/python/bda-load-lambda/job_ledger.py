@@ -0,0 +1,258 @@
+import abc
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+# Read-modify-write attempts before a ledger update gives up on a constantly changing entry
+LEDGER_UPDATE_ATTEMPTS = 5
+
+# Entries under this prefix point a BDA job id at the ledger entry it was submitted for
+JOB_POINTER_PREFIX = 'jobs/'
+
+# S3 errors meaning a conditional write lost to another writer (NoSuchKey: IfMatch on a deleted entry)
+CONDITIONAL_WRITE_CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey')
+
+
+def document_content_hash(s3, bucket, key, chunk_size=1024 * 1024):
+    # SHA-256 of the document bytes, streamed so large PDFs are never fully buffered
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    digest = hashlib.sha256()
+    for chunk in body.iter_chunks(chunk_size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def invocation_job_id(invocation_arn):
+    # BDA completion events carry the last segment of the invocation ARN as job_id
+    return invocation_arn.rsplit('/', 1)[-1]
+
+
+def ledger_entry_key(content_hash, blueprint_arn, blueprint_stage, blueprint_version):
+    # A result depends on the blueprint as much as the document, so a blueprint change starts fresh entries
+    blueprint = f"{blueprint_arn}|{blueprint_stage}|{blueprint_version}"
+    return f"{content_hash}-{hashlib.sha256(blueprint.encode('utf-8')).hexdigest()[:16]}"
+
+
+class JobLedgerStore(abc.ABC):
+    # Storage for ledger entries keyed by document content hash and blueprint. Every read returns a version token
+    # and every write is conditional on it, so concurrent writers never silently overwrite each other
+
+    @abc.abstractmethod
+    def get(self, entry_key):
+        """Returns (entry, version), or (None, None) when there is no entry"""
+
+    @abc.abstractmethod
+    def create(self, entry_key, entry):
+        """Store the entry only if none exists yet; returns False when another writer got there first"""
+
+    @abc.abstractmethod
+    def put(self, entry_key, entry, version):
+        """Replace the entry only if it is still at version; returns False when it changed or vanished"""
+
+
+class S3JobLedgerStore(JobLedgerStore):
+    # The object ETag is the version, checked by S3 conditional writes
+    def __init__(self, s3, bucket, prefix='bda-ledger/'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, entry_key):
+        return f"{self.prefix}{entry_key}.json"
+
+    def get(self, entry_key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._key(entry_key))
+        except self.s3.exceptions.NoSuchKey:
+            return None, None
+        return json.loads(response['Body'].read()), response['ETag']
+
+    def _conditional_put(self, entry_key, entry, **condition):
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=self._key(entry_key),
+                Body=json.dumps(entry),
+                ContentType='application/json',
+                **condition
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in CONDITIONAL_WRITE_CONFLICT_CODES:
+                return False
+            raise
+
+    def create(self, entry_key, entry):
+        # Conditional write so duplicate deliveries racing each other submit only one job
+        return self._conditional_put(entry_key, entry, IfNoneMatch='*')
+
+    def put(self, entry_key, entry, version):
+        return self._conditional_put(entry_key, entry, IfMatch=version)
+
+
+class LocalFileJobLedgerStore(JobLedgerStore):
+    # One JSON file per entry in a local directory, for tests and local runs. The version is a
+    # digest of the file bytes, compared and replaced under an exclusive lock on a sibling lock file
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, entry_key):
+        return os.path.join(self.directory, f"{entry_key}.json")
+
+    @contextlib.contextmanager
+    def _locked(self, entry_key):
+        with open(f"{self._path(entry_key)}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, entry_key):
+        try:
+            with open(self._path(entry_key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None, None
+        return json.loads(data), hashlib.sha256(data).hexdigest()
+
+    def get(self, entry_key):
+        return self._read(entry_key)
+
+    def create(self, entry_key, entry):
+        os.makedirs(os.path.dirname(self._path(entry_key)), exist_ok=True)
+        with self._locked(entry_key):
+            try:
+                with open(self._path(entry_key), 'x', encoding='utf-8') as f:
+                    json.dump(entry, f)
+                return True
+            except FileExistsError:
+                return False
+
+    def put(self, entry_key, entry, version):
+        with self._locked(entry_key):
+            if self._read(entry_key)[1] != version:
+                return False
+            # Write then rename so readers never see a truncated entry
+            tmp_path = f"{self._path(entry_key)}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(entry_key))
+            return True
+
+
+class LedgerConflict(Exception):
+    # Raised when an entry kept changing between read and conditional write for every attempt
+    pass
+
+
+class JobLedger:
+    # Tracks one BDA job per distinct document and blueprint so duplicates reuse its output instead of paying again.
+    # Every change is a read-modify-write retried on conflict, like the supplier matcher's alias table
+    def __init__(self, store, in_flight_ttl_seconds=3600, submit_grace_seconds=600):
+        self.store = store
+        self.in_flight_ttl_seconds = in_flight_ttl_seconds
+        # A claim that still has no invocation ARN after this long died before submitting (e.g. a timed-out invocation)
+        self.submit_grace_seconds = submit_grace_seconds
+
+    def _new_entry(self, input_key, result_key):
+        return {
+            'status': IN_FLIGHT,
+            'input_key': input_key,
+            'result_key': result_key,
+            'waiting_keys': [],
+            'invocationArn': None,
+            'updated_at': time.time()
+        }
+
+    def _in_flight(self, entry):
+        age = time.time() - entry['updated_at']
+        if entry['status'] != IN_FLIGHT or age >= self.in_flight_ttl_seconds:
+            return False
+        return bool(entry.get('invocationArn')) or age < self.submit_grace_seconds
+
+    def _write(self, entry_key, entry, version):
+        # Create when there was no entry, otherwise replace only the version that was read
+        if version is None:
+            return self.store.create(entry_key, entry)
+        return self.store.put(entry_key, entry, version)
+
+    def get(self, entry_key):
+        return self.store.get(entry_key)[0]
+
+    def claim(self, entry_key, input_key, result_key):
+        # Returns (True, entry) when the caller should submit a job, else (False, existing entry)
+        entry = self._new_entry(input_key, result_key)
+        if self.store.create(entry_key, entry):
+            return True, entry
+        return self._claim(entry_key, input_key, result_key, take_over_done=False)
+
+    def restart(self, entry_key, input_key, result_key):
+        # Take over a done entry whose result is gone; returns (False, entry) if another caller already restarted it
+        return self._claim(entry_key, input_key, result_key, take_over_done=True)
+
+    def _claim(self, entry_key, input_key, result_key, take_over_done):
+        for _ in range(LEDGER_UPDATE_ATTEMPTS):
+            existing, version = self.store.get(entry_key)
+            if existing and existing['status'] == DONE and not take_over_done:
+                return False, existing
+
+            if existing and self._in_flight(existing):
+                if result_key == existing['result_key'] or result_key in existing['waiting_keys']:
+                    return False, existing
+                # Ask the running job to also write its result for this document
+                existing['waiting_keys'].append(result_key)
+                if self.store.put(entry_key, existing, version):
+                    return False, existing
+                continue
+
+            # Missing, failed, stale, abandoned or lost entries are taken over by a fresh job; only one racing
+            # caller wins. Documents that were waiting on the old job, and its own, get the new job's result
+            entry = self._new_entry(input_key, result_key)
+            if existing:
+                for waiting_key in [existing.get('result_key'), *existing.get('waiting_keys', [])]:
+                    if waiting_key and waiting_key != result_key and waiting_key not in entry['waiting_keys']:
+                        entry['waiting_keys'].append(waiting_key)
+            if self._write(entry_key, entry, version):
+                return True, entry
+
+        raise LedgerConflict(f"Ledger entry {entry_key} kept changing during claim")
+
+    def _update(self, entry_key, **fields):
+        for _ in range(LEDGER_UPDATE_ATTEMPTS):
+            entry, version = self.store.get(entry_key)
+            entry = entry or {'waiting_keys': []}
+            entry.update(fields, updated_at=time.time())
+            if self._write(entry_key, entry, version):
+                return entry
+
+        raise LedgerConflict(f"Ledger entry {entry_key} kept changing during update")
+
+    def record_submission(self, entry_key, invocation_arn):
+        # The job pointer lets the completion event find the entry without re-reading the document,
+        # which may have been overwritten or deleted while the job ran
+        # The submit time lets the completion handler report how long the job took
+        self.store.create(f"{JOB_POINTER_PREFIX}{invocation_job_id(invocation_arn)}",
+                          {'entry_key': entry_key, 'submitted_at': time.time()})
+        return self._update(entry_key, invocationArn=invocation_arn)
+
+    def job_pointer(self, job_id):
+        pointer, _ = self.store.get(f"{JOB_POINTER_PREFIX}{job_id}")
+        return pointer
+
+    def complete(self, entry_key, result_key):
+        # Re-read on conflict, so duplicates that started waiting meanwhile are in the returned waiting_keys
+        return self._update(entry_key, status=DONE, result_key=result_key)
+
+    def fail(self, entry_key, error):
+        return self._update(entry_key, status=FAILED, error=error)
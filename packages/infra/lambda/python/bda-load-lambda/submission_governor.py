@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Error codes BDA and the AWS SDK use when a submission is rejected for rate or quota reasons
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'ServiceQuotaExceededException',
+    'RequestLimitExceeded'
+}
+
+
+class SubmissionThrottled(Exception):
+    # Raised when BDA kept throttling a submission past the retry deadline
+    pass
+
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second on average, with bursts of up to `burst`
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve a token now, possibly going negative, so waiting callers are served in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SubmissionGovernor:
+    # Rate-limits and bounds concurrent BDA submissions, retrying throttled ones with backoff
+    def __init__(self, rate, burst=1, max_in_flight=1, initial_delay_seconds=1,
+                 max_delay_seconds=20, deadline_seconds=60):
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+        self.initial_delay_seconds = initial_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.deadline_seconds = deadline_seconds
+        self.throttled_count = 0
+
+    def submit(self, submit_fn, **kwargs):
+        deadline = time.monotonic() + self.deadline_seconds
+        delay = self.initial_delay_seconds
+        attempt = 0
+
+        while True:
+            attempt += 1
+            with self.in_flight:
+                self.bucket.acquire()
+                try:
+                    return submit_fn(**kwargs)
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                        raise
+                    self.throttled_count += 1
+                    error = e
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SubmissionThrottled(f"Submission still throttled after {attempt} attempts") from error
+
+            # Full jitter keeps a burst of throttled callers from retrying in lockstep
+            sleep_seconds = min(random.uniform(0, delay), remaining)
+            print(f"Submission throttled ({error.response['Error']['Code']}), retrying in {sleep_seconds:.1f}s")
+            time.sleep(sleep_seconds)
+            delay = min(delay * 2, self.max_delay_seconds)
+
+
+class SubmissionDeferred(Exception):
+    # Raised when the shared submission limits have no room; the event should be retried after retry_after seconds
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SubmissionCapacity:
+    # Submission limits shared by every execution environment: a token bucket for jobs per second and the
+    # set of jobs still running, kept in one state object in a JobLedgerStore and changed by conditional writes
+    def __init__(self, store, rate, burst=1, max_in_flight=0, slot_ttl_seconds=3600,
+                 full_retry_seconds=60, key='submission-capacity', attempts=5):
+        self.store = store
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_in_flight = max_in_flight
+        # Slots whose completion was never seen are reclaimed after this long
+        self.slot_ttl_seconds = slot_ttl_seconds
+        self.full_retry_seconds = full_retry_seconds
+        self.key = key
+        self.attempts = attempts
+
+    def _state(self, now):
+        state, version = self.store.get(self.key)
+        state = state or {'tokens': float(self.burst), 'updated_at': now, 'jobs': {}}
+        state['jobs'] = {slot: started for slot, started in state['jobs'].items() if now - started < self.slot_ttl_seconds}
+        if self.rate > 0:
+            elapsed = max(0.0, now - state['updated_at'])
+            state['tokens'] = min(float(self.burst), state['tokens'] + elapsed * self.rate)
+        state['updated_at'] = now
+        return state, version
+
+    def _write(self, state, version):
+        if version is None:
+            return self.store.create(self.key, state)
+        return self.store.put(self.key, state, version)
+
+    def acquire(self, slot_id):
+        # Takes a slot and a token for one job; returns 0 when taken, else the seconds to wait before trying again
+        for _ in range(self.attempts):
+            now = time.time()
+            state, version = self._state(now)
+            if slot_id in state['jobs']:
+                return 0
+            if self.max_in_flight > 0 and len(state['jobs']) >= self.max_in_flight:
+                return self.full_retry_seconds
+            if self.rate > 0 and state['tokens'] < 1:
+                return (1 - state['tokens']) / self.rate
+
+            state['jobs'][slot_id] = now
+            if self.rate > 0:
+                state['tokens'] -= 1
+            if self._write(state, version):
+                return 0
+
+        # Constant contention on the state object; back off briefly like a throttled caller
+        return random.uniform(0.1, 1.0)
+
+    def release(self, slot_id):
+        for _ in range(self.attempts):
+            state, version = self._state(time.time())
+            if slot_id not in state['jobs']:
+                return
+            del state['jobs'][slot_id]
+            if self._write(state, version):
+                return
+        print(f"Could not release submission slot {slot_id}; it expires after {self.slot_ttl_seconds:.0f}s")
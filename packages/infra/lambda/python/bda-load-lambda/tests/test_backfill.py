@@ -0,0 +1,148 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The shared metrics module is deployed as a Lambda layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'pipeline-metrics-layer', 'python'))
+
+import backfill
+import index_bda_call
+
+
+class StubS3:
+    def __init__(self, objects):
+        self.objects = dict(objects)
+
+    def get_paginator(self, name):
+        stub = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(k for k in stub.objects if k.startswith(Prefix))
+                # Two keys per page to exercise pagination
+                for i in range(0, max(len(keys), 1), 2):
+                    yield {'Contents': [{'Key': k} for k in keys[i:i + 2]]}
+
+        return Paginator()
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key].encode('utf-8'))}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+
+class StubBDA:
+    def __init__(self, s3, failing_inputs=()):
+        self.s3 = s3
+        self.failing_inputs = set(failing_inputs)
+        self.submitted = []
+        self.payloads = []
+        self.jobs = {}
+
+    def invoke_data_automation_async(self, **payload):
+        input_uri = payload['inputConfiguration']['s3Uri']
+        output_uri = payload['outputConfiguration']['s3Uri']
+        invocation_id = f"{len(self.submitted) + 1:04d}"
+        invocation_arn = f"arn:aws:bedrock:us-east-1:123456789012:data-automation-invocation/{invocation_id}"
+        self.submitted.append(input_uri)
+        self.payloads.append(payload)
+        self.jobs[invocation_arn] = (input_uri, f"{output_uri}/{invocation_id}")
+
+        # Write the custom output the real service would produce, in a folder per invocation
+        output_prefix = f"{output_uri.split('/', 3)[3]}/{invocation_id}"
+        self.s3.objects[f"{output_prefix}/0/custom_output/0/result.json"] = json.dumps({
+            'matched_blueprint': {'name': 'ComprehensiveInvoiceBlueprint'},
+            'inference_result': {'Vendor': input_uri.rsplit('/', 1)[-1]}
+        })
+        return {'invocationArn': invocation_arn}
+
+    def get_data_automation_status(self, invocationArn):
+        input_uri, job_output_uri = self.jobs[invocationArn]
+        if input_uri in self.failing_inputs:
+            return {'status': 'ClientError', 'errorType': 'ValidationException', 'errorMessage': 'Unsupported file'}
+        return {'status': 'Success', 'outputConfiguration': {'s3Uri': f"{job_output_uri}/job_metadata.json"}}
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    s3 = StubS3({
+        'datasets/documents/invoice_a.pdf': '',
+        'datasets/documents/invoice_b.pdf': '',
+        'datasets/documents/invoice_c.pdf': '',
+        'bda-result/invoice-c-result.json': '{}',
+    })
+    bda = StubBDA(s3)
+    monkeypatch.setattr(index_bda_call, 's3', s3)
+    monkeypatch.setattr(index_bda_call, 'bda', bda)
+    return s3, bda
+
+
+def test_backfill_skips_existing_results_and_writes_new_ones(stubs):
+    s3, bda = stubs
+
+    summary = backfill.run_backfill('data-bucket', 'arn:blueprint', rate=0)
+
+    assert summary == {'pending': 2, 'skipped': 1, 'done': 2, 'failed': 0}
+    assert sorted(bda.submitted) == [
+        's3://data-bucket/datasets/documents/invoice_a.pdf',
+        's3://data-bucket/datasets/documents/invoice_b.pdf',
+    ]
+    result = json.loads(s3.objects['bda-result/invoice-a-result.json'])
+    assert result['inference_result'] == {'Vendor': 'invoice_a.pdf'}
+    # The backfill processes its own output, so the completion event is not requested
+    assert all(not p['notificationConfiguration']['eventBridgeConfiguration']['eventBridgeEnabled'] for p in bda.payloads)
+
+
+def test_rerun_aggregates_only_the_new_job_output(stubs):
+    s3, bda = stubs
+    # Output left by an earlier run with another blueprint, in a job folder that sorts first
+    s3.objects['bda-result-raw/invoice_a/0000/0/custom_output/0/result.json'] = json.dumps({
+        'matched_blueprint': {'name': 'OldInvoiceBlueprint'},
+        'inference_result': {'Vendor': 'stale'}
+    })
+    s3.objects['bda-result-raw/invoice_a/0000/0/custom_output/1/result.json'] = json.dumps({
+        'matched_blueprint': {'name': 'OldInvoiceBlueprint'},
+        'inference_result': {'Vendor': 'stale page'}
+    })
+
+    summary = backfill.run_backfill('data-bucket', 'arn:blueprint', rate=0, force=True)
+
+    assert summary['done'] == 3
+    result = json.loads(s3.objects['bda-result/invoice-a-result.json'])
+    assert result['matched_blueprint'] == {'name': 'ComprehensiveInvoiceBlueprint'}
+    assert [segment['inference_result'] for segment in result['segments']] == [{'Vendor': 'invoice_a.pdf'}]
+
+
+def test_backfill_records_failures_and_resumes(stubs, tmp_path):
+    s3, bda = stubs
+    bda.failing_inputs.add('s3://data-bucket/datasets/documents/invoice_b.pdf')
+    state_file = str(tmp_path / 'state.json')
+
+    summary = backfill.run_backfill('data-bucket', 'arn:blueprint', rate=0, state_file=state_file, force=True)
+
+    assert summary['done'] == 2 and summary['failed'] == 1
+    state = json.load(open(state_file))['documents']
+    assert state['datasets/documents/invoice_b.pdf']['errorMessage'] == 'Unsupported file'
+
+    # Only the failed document is retried on resume
+    bda.failing_inputs.clear()
+    bda.submitted.clear()
+    summary = backfill.run_backfill('data-bucket', 'arn:blueprint', rate=0, state_file=state_file, force=True)
+
+    assert summary == {'pending': 1, 'skipped': 2, 'done': 1, 'failed': 0}
+    assert bda.submitted == ['s3://data-bucket/datasets/documents/invoice_b.pdf']
+
+
+def test_dry_run_submits_nothing(stubs):
+    _, bda = stubs
+
+    summary = backfill.run_backfill('data-bucket', 'arn:blueprint', dry_run=True)
+
+    assert summary['pending'] == 2
+    assert bda.submitted == []
@@ -0,0 +1,366 @@
+import hashlib
+import io
+import json
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The shared metrics module is deployed as a Lambda layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'pipeline-metrics-layer', 'python'))
+
+import index_bda_call
+from job_ledger import DONE, FAILED, IN_FLIGHT, JobLedger, JobLedgerStore, LocalFileJobLedgerStore, S3JobLedgerStore
+from submission_governor import SubmissionCapacity
+
+
+class StubBody(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        return iter(lambda: self.read(chunk_size), b'')
+
+
+class StubS3:
+    def __init__(self, objects):
+        self.objects = {k: v.encode('utf-8') for k, v in objects.items()}
+
+    def get_object(self, Bucket, Key):
+        return {'Body': StubBody(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+
+class ConditionalStubS3:
+    # Just enough of S3 conditional writes (IfNoneMatch / IfMatch on the ETag) for the ledger store
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        body = self.objects[Key]
+        return {'Body': io.BytesIO(body), 'ETag': hashlib.md5(body).hexdigest()}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, IfNoneMatch=None, IfMatch=None):
+        if IfNoneMatch == '*' and Key in self.objects:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+        if IfMatch is not None:
+            if Key not in self.objects:
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'PutObject')
+            if hashlib.md5(self.objects[Key]).hexdigest() != IfMatch:
+                raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+        self.objects[Key] = Body.encode('utf-8')
+
+
+class InterleavingStore(JobLedgerStore):
+    # Wraps a store and runs a queued action right after the next read, as another writer would
+    def __init__(self, store):
+        self.store = store
+        self.after_next_get = None
+
+    def get(self, entry_key):
+        result = self.store.get(entry_key)
+        action, self.after_next_get = self.after_next_get, None
+        if action:
+            action()
+        return result
+
+    def create(self, entry_key, entry):
+        return self.store.create(entry_key, entry)
+
+    def put(self, entry_key, entry, version):
+        return self.store.put(entry_key, entry, version)
+
+
+class StubBDA:
+    def __init__(self):
+        self.submitted = []
+        self.payloads = []
+        self.errors = []
+
+    def invoke_data_automation_async(self, **payload):
+        self.submitted.append(payload['inputConfiguration']['s3Uri'])
+        self.payloads.append(payload)
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'invocationArn': f"arn:aws:bedrock:us-east-1:123456789012:data-automation-invocation/{len(self.submitted)}"}
+
+    def get_data_automation_status(self, invocationArn):
+        return {'status': 'Success'}
+
+
+class StubSQS:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+def upload_event(key):
+    return {'detail': {'bucket': {'name': 'data-bucket'}, 'object': {'key': key}}}
+
+
+def upload_message(key, message_id):
+    return {'messageId': message_id, 'body': json.dumps(upload_event(key))}
+
+
+def completion_event(key, invocation_arn, detail_type=index_bda_call.BDA_JOB_SUCCEEDED):
+    return {
+        'source': 'aws.bedrock',
+        'detail-type': detail_type,
+        'detail': {'job_id': invocation_arn.rsplit('/', 1)[-1], 'input_s3_object': {'s3_bucket': 'data-bucket', 'name': key}}
+    }
+
+
+@pytest.fixture
+def stubs(monkeypatch, tmp_path):
+    s3 = StubS3({
+        'datasets/documents/invoice_a.pdf': 'same bytes',
+        'datasets/documents/invoice_a_copy.pdf': 'same bytes',
+        'datasets/documents/invoice_b.pdf': 'other bytes',
+    })
+    bda = StubBDA()
+    ledger = JobLedger(LocalFileJobLedgerStore(str(tmp_path)))
+    monkeypatch.setattr(index_bda_call, 's3', s3)
+    monkeypatch.setattr(index_bda_call, 'bda', bda)
+    monkeypatch.setattr(index_bda_call, 'ledger', ledger)
+    monkeypatch.setattr(index_bda_call, 'TARGET_BUCKET_NAME', 'data-bucket')
+    monkeypatch.setattr(index_bda_call, 'CUSTOM_BLUEPRINT_ARN', 'arn:aws:bedrock:us-east-1:123456789012:blueprint/invoice')
+    monkeypatch.setattr(index_bda_call, 'BDA_WAIT_FOR_COMPLETION', False)
+    return s3, bda, ledger
+
+
+def fake_process_output(s3):
+    def process(output_s3_uri_raw, targetkey, first_only=False):
+        s3.objects[targetkey] = json.dumps({'source': output_s3_uri_raw}).encode('utf-8')
+        return f"s3://data-bucket/{targetkey}"
+    return process
+
+
+@pytest.fixture(params=['local', 's3'])
+def store(request, tmp_path):
+    if request.param == 'local':
+        return LocalFileJobLedgerStore(str(tmp_path))
+    return S3JobLedgerStore(ConditionalStubS3(), 'data-bucket')
+
+
+def test_duplicate_waiting_during_complete_is_not_lost(store):
+    racing = InterleavingStore(store)
+    ledger, duplicate = JobLedger(racing), JobLedger(store)
+    assert ledger.claim('hash', 'a.pdf', 'a-result.json')[0]
+
+    # A duplicate registers itself between complete() reading the entry and writing it back
+    racing.after_next_get = lambda: duplicate.claim('hash', 'b.pdf', 'b-result.json')
+    entry = ledger.complete('hash', 'a-result.json')
+
+    assert entry['status'] == DONE
+    assert entry['waiting_keys'] == ['b-result.json']
+    assert ledger.get('hash') == entry
+
+
+def test_concurrent_restarts_submit_once(store):
+    racing = InterleavingStore(store)
+    ledger, other = JobLedger(racing), JobLedger(store)
+    ledger.claim('hash', 'a.pdf', 'a-result.json')
+    ledger.fail('hash', 'ServiceError')
+
+    # Two retries of the failed document read the entry before either takes it over
+    outcomes = []
+    racing.after_next_get = lambda: outcomes.append(other.claim('hash', 'a.pdf', 'a-result.json'))
+    outcomes.append(ledger.claim('hash', 'a.pdf', 'a-result.json'))
+
+    assert [claimed for claimed, _ in outcomes] == [True, False]
+    assert ledger.get('hash')['status'] == IN_FLIGHT
+
+    # Same for a done entry whose result went missing
+    ledger.complete('hash', 'a-result.json')
+    outcomes = []
+    racing.after_next_get = lambda: outcomes.append(other.restart('hash', 'b.pdf', 'b-result.json'))
+    outcomes.append(ledger.restart('hash', 'c.pdf', 'c-result.json'))
+
+    assert [claimed for claimed, _ in outcomes] == [True, False]
+    # The lost result is rewritten by the new job along with the later duplicate's
+    assert ledger.get('hash')['waiting_keys'] == ['a-result.json', 'c-result.json']
+
+
+def test_abandoned_claim_is_taken_over_after_the_grace_period(store):
+    ledger = JobLedger(store, submit_grace_seconds=60)
+    ledger.claim('hash', 'a.pdf', 'a-result.json')
+    assert not ledger.claim('hash', 'b.pdf', 'b-result.json')[0]
+
+    # The claiming invocation died before it recorded an invocation ARN
+    entry, version = store.get('hash')
+    entry['updated_at'] -= 120
+    assert store.put('hash', entry, version)
+
+    claimed, entry = ledger.claim('hash', 'c.pdf', 'c-result.json')
+    assert claimed
+    assert entry['waiting_keys'] == ['a-result.json', 'b-result.json']
+
+
+def test_duplicate_upload_while_in_flight_is_not_resubmitted(stubs, monkeypatch):
+    s3, bda, ledger = stubs
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', fake_process_output(s3))
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    response = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a_copy.pdf'), None)
+    index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_b.pdf'), None)
+
+    assert response['deduplicated'] is True
+    assert len(bda.submitted) == 2
+
+    # Completing the one real job also writes the result for the duplicate that waited on it
+    index_bda_call.lambda_handler(completion_event('datasets/documents/invoice_a.pdf', submitted['invocationArn']), None)
+    assert s3.objects['bda-result/invoice-a-copy-result.json'] == s3.objects['bda-result/invoice-a-result.json']
+    # Only the completed job's own output folder is aggregated, never the whole document prefix
+    assert json.loads(s3.objects['bda-result/invoice-a-result.json'])['source'] == 's3://data-bucket/bda-result-raw/invoice_a/1'
+
+    entry = ledger.get(response['ledgerKey'])
+    assert entry['status'] == DONE
+
+
+def test_completed_document_reuses_result_and_failed_document_resubmits(stubs, monkeypatch):
+    s3, bda, ledger = stubs
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', fake_process_output(s3))
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    index_bda_call.lambda_handler(completion_event('datasets/documents/invoice_a.pdf', submitted['invocationArn']), None)
+
+    response = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a_copy.pdf'), None)
+    assert response['result'] == 's3://data-bucket/bda-result/invoice-a-copy-result.json'
+    assert len(bda.submitted) == 1
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_b.pdf'), None)
+    index_bda_call.lambda_handler(completion_event(
+        'datasets/documents/invoice_b.pdf', submitted['invocationArn'], 'Bedrock Data Automation Job Failed With Client Error'
+    ), None)
+    entry_key = index_bda_call.document_ledger_key('data-bucket', 'datasets/documents/invoice_b.pdf')
+    assert ledger.get(entry_key)['status'] == FAILED
+
+    # A failed job does not block a retry of the same document
+    response = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_b.pdf'), None)
+    assert 'deduplicated' not in response
+    assert len(bda.submitted) == 3
+    assert ledger.get(entry_key)['status'] == IN_FLIGHT
+
+
+def test_failed_submission_releases_the_claim_for_the_retry(stubs):
+    s3, bda, ledger = stubs
+    bda.errors.append(ClientError({'Error': {'Code': 'ValidationException', 'Message': 'Bad input'}}, 'InvokeDataAutomationAsync'))
+
+    with pytest.raises(ClientError):
+        index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    entry_key = index_bda_call.document_ledger_key('data-bucket', 'datasets/documents/invoice_a.pdf')
+    assert ledger.get(entry_key)['status'] == FAILED
+
+    # Lambda's retry submits the job instead of being deduplicated against the claim
+    response = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    assert 'deduplicated' not in response
+    assert len(bda.submitted) == 2
+    assert ledger.get(entry_key)['invocationArn'] == response['invocationArn']
+
+
+def test_blueprint_change_does_not_reuse_old_results(stubs, monkeypatch):
+    s3, bda, ledger = stubs
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', fake_process_output(s3))
+    monkeypatch.setattr(index_bda_call, 'CUSTOM_BLUEPRINT_VERSION', 'schema-1')
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    index_bda_call.lambda_handler(completion_event('datasets/documents/invoice_a.pdf', submitted['invocationArn']), None)
+
+    # The same invoice after a blueprint schema change is processed again, not copied from the old result
+    monkeypatch.setattr(index_bda_call, 'CUSTOM_BLUEPRINT_VERSION', 'schema-2')
+    response = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a_copy.pdf'), None)
+
+    assert 'deduplicated' not in response
+    assert len(bda.submitted) == 2
+
+
+def test_completion_settles_the_submitted_entry_after_the_document_changes(stubs, monkeypatch):
+    s3, bda, ledger = stubs
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', fake_process_output(s3))
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    duplicate = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a_copy.pdf'), None)
+
+    # The source is overwritten while the job runs, so re-hashing it would find a different entry
+    s3.objects['datasets/documents/invoice_a.pdf'] = b'edited bytes'
+    index_bda_call.lambda_handler(completion_event('datasets/documents/invoice_a.pdf', submitted['invocationArn']), None)
+
+    assert ledger.get(duplicate['ledgerKey'])['status'] == DONE
+    assert 'bda-result/invoice-a-copy-result.json' in s3.objects
+
+
+def test_completion_records_bda_wait_from_the_submit_time(stubs, monkeypatch):
+    s3, bda, ledger = stubs
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', fake_process_output(s3))
+    now = [1000.0]
+    monkeypatch.setattr(index_bda_call.time, 'time', lambda: now[0])
+    index_bda_call.metrics.reset()
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    now[0] += 42
+    index_bda_call.handle_bda_completion(completion_event('datasets/documents/invoice_a.pdf', submitted['invocationArn']))
+
+    assert index_bda_call.metrics.durations['BdaWait'] == pytest.approx(42000)
+    index_bda_call.metrics.reset()
+
+
+def test_polled_job_is_not_processed_again_by_its_completion_event(stubs, monkeypatch):
+    s3, bda, ledger = stubs
+    processed = []
+    process = fake_process_output(s3)
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', lambda *args: processed.append(args) or process(*args))
+    monkeypatch.setattr(index_bda_call, 'BDA_WAIT_FOR_COMPLETION', True)
+
+    submitted = index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_a.pdf'), None)
+    assert len(processed) == 1
+
+    # The completion rule still delivers the event for the polled job
+    assert index_bda_call.lambda_handler(completion_event('datasets/documents/invoice_a.pdf', submitted['invocationArn']), None) is None
+    assert len(processed) == 1
+
+    # Without a ledger to check against, polling mode does not ask for the completion event at all
+    monkeypatch.setattr(index_bda_call, 'ledger', None)
+    index_bda_call.lambda_handler(upload_event('datasets/documents/invoice_b.pdf'), None)
+    assert not bda.payloads[-1]['notificationConfiguration']['eventBridgeConfiguration']['eventBridgeEnabled']
+
+
+def test_uploads_wait_in_the_queue_for_in_flight_capacity(stubs, monkeypatch, tmp_path):
+    s3, bda, ledger = stubs
+    monkeypatch.setattr(index_bda_call, 'process_bda_output', fake_process_output(s3))
+    capacity = SubmissionCapacity(LocalFileJobLedgerStore(str(tmp_path / 'capacity')), rate=0, max_in_flight=1)
+    monkeypatch.setattr(index_bda_call, 'capacity', capacity)
+    monkeypatch.setattr(index_bda_call, 'UPLOAD_QUEUE_URL', 'https://sqs.us-east-1.amazonaws.com/123456789012/uploads')
+    sqs = StubSQS()
+    monkeypatch.setattr(index_bda_call, 'sqs', sqs)
+
+    response = index_bda_call.lambda_handler({'Records': [
+        upload_message('datasets/documents/invoice_a.pdf', 'm1'),
+        upload_message('datasets/documents/invoice_b.pdf', 'm2'),
+    ]}, None)
+
+    # Only one job may run, so the second upload is requeued with a delay and its claim released
+    assert response == {'batchItemFailures': []}
+    assert bda.submitted == ['s3://data-bucket/datasets/documents/invoice_a.pdf']
+    [requeued] = sqs.sent
+    assert requeued['DelaySeconds'] >= capacity.full_retry_seconds
+    assert ledger.get(index_bda_call.document_ledger_key('data-bucket', 'datasets/documents/invoice_b.pdf'))['status'] == FAILED
+
+    index_bda_call.lambda_handler(completion_event('datasets/documents/invoice_a.pdf', 'arn/1'), None)
+    response = index_bda_call.lambda_handler({'Records': [{'messageId': 'm3', 'body': requeued['MessageBody']}]}, None)
+    assert response == {'batchItemFailures': []}
+    assert bda.submitted[-1] == 's3://data-bucket/datasets/documents/invoice_b.pdf'
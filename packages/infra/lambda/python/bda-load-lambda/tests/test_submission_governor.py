@@ -0,0 +1,107 @@
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import submission_governor
+from job_ledger import LocalFileJobLedgerStore
+from submission_governor import SubmissionCapacity, SubmissionGovernor, SubmissionThrottled, TokenBucket
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'InvokeDataAutomationAsync')
+
+
+class FlakyBDA:
+    def __init__(self, throttles, code='ThrottlingException'):
+        self.throttles = throttles
+        self.code = code
+        self.calls = 0
+
+    def invoke_data_automation_async(self, **payload):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise client_error(self.code)
+        return {'invocationArn': f"arn:{payload['inputConfiguration']['s3Uri']}"}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(submission_governor.time, 'sleep', slept.append)
+    return slept
+
+
+def test_throttled_submission_is_retried_with_backoff(sleeps):
+    bda = FlakyBDA(throttles=2)
+    governor = SubmissionGovernor(rate=0, initial_delay_seconds=1, max_delay_seconds=20)
+
+    response = governor.submit(bda.invoke_data_automation_async, inputConfiguration={'s3Uri': 's3://b/doc.pdf'})
+
+    assert response == {'invocationArn': 'arn:s3://b/doc.pdf'}
+    assert bda.calls == 3
+    assert governor.throttled_count == 2
+    assert len(sleeps) == 2 and sleeps[0] <= 1 and sleeps[1] <= 2
+
+
+def test_submission_gives_up_after_deadline(sleeps):
+    bda = FlakyBDA(throttles=100)
+    governor = SubmissionGovernor(rate=0, deadline_seconds=0)
+
+    with pytest.raises(SubmissionThrottled):
+        governor.submit(bda.invoke_data_automation_async, inputConfiguration={'s3Uri': 's3://b/doc.pdf'})
+    assert bda.calls == 1
+
+
+def test_other_errors_are_not_retried(sleeps):
+    bda = FlakyBDA(throttles=1, code='ValidationException')
+    governor = SubmissionGovernor(rate=0)
+
+    with pytest.raises(ClientError):
+        governor.submit(bda.invoke_data_automation_async, inputConfiguration={'s3Uri': 's3://b/doc.pdf'})
+    assert sleeps == []
+
+
+def test_token_bucket_spaces_acquisitions_after_burst(sleeps):
+    bucket = TokenBucket(rate=2, burst=2)
+    for _ in range(4):
+        bucket.acquire()
+
+    # The burst goes through immediately, then each caller waits its turn at 2 per second
+    assert len(sleeps) == 2
+    assert sleeps[0] == pytest.approx(0.5, abs=0.05)
+    assert sleeps[1] == pytest.approx(1.0, abs=0.05)
+
+
+def test_capacity_limits_jobs_in_flight_until_one_is_released(tmp_path):
+    store = LocalFileJobLedgerStore(str(tmp_path))
+    capacity = SubmissionCapacity(store, rate=0, max_in_flight=2, full_retry_seconds=30)
+    # A second execution environment sees the same state
+    other = SubmissionCapacity(store, rate=0, max_in_flight=2, full_retry_seconds=30)
+
+    assert capacity.acquire('s3://b/a.pdf') == 0
+    assert other.acquire('s3://b/b.pdf') == 0
+    assert capacity.acquire('s3://b/c.pdf') == 30
+
+    other.release('s3://b/a.pdf')
+    assert capacity.acquire('s3://b/c.pdf') == 0
+
+
+def test_capacity_rate_limit_and_expired_slots(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(submission_governor.time, 'time', lambda: now[0])
+    capacity = SubmissionCapacity(LocalFileJobLedgerStore(str(tmp_path)), rate=2, burst=1, max_in_flight=1,
+                                  slot_ttl_seconds=600)
+
+    assert capacity.acquire('s3://b/a.pdf') == 0
+    # The in-flight limit binds first; once the slot expires the token bucket has refilled
+    assert capacity.acquire('s3://b/b.pdf') == capacity.full_retry_seconds
+    now[0] += 600
+    assert capacity.acquire('s3://b/b.pdf') == 0
+
+    capacity.release('s3://b/b.pdf')
+    now[0] += 0.1
+    assert capacity.acquire('s3://b/c.pdf') == pytest.approx(0.4)
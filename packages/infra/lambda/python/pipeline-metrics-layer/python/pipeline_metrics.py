@@ -0,0 +1,119 @@
+"""
+Per-invocation stage timings and counts for the document pipeline Lambdas.
+
+Durations and counts are accumulated while a handler runs and written as one
+CloudWatch Embedded Metric Format (EMF) JSON line when it returns, so they become
+CloudWatch metrics without any PutMetricData calls.
+
+    metrics = PipelineMetrics('bda-load')
+
+    with metrics.stage('BdaSubmit'):
+        ...
+
+    @metrics.timed('S3List')
+    def list_result_keys(...):
+        ...
+
+    metrics.count('ResultFilesRead', len(keys))
+
+    @metrics.flush_after_invocation
+    def lambda_handler(event, context):
+        ...
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# CloudWatch namespace the EMF metrics are published under
+METRICS_NAMESPACE = os.environ.get('PIPELINE_METRICS_NAMESPACE', 'InvoicePipeline')
+
+# Set to false to stop writing metric lines, e.g. in local runs
+METRICS_ENABLED = os.environ.get('PIPELINE_METRICS_ENABLED', 'true').lower() == 'true'
+
+
+class PipelineMetrics:
+    def __init__(self, service, namespace=METRICS_NAMESPACE):
+        self.service = service
+        self.namespace = namespace
+        self.durations = {}
+        self.counts = {}
+        # Stages can run on worker threads, e.g. parallel S3 reads
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        # Time the enclosed block; repeated stages in one invocation are summed
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_duration(name, (time.perf_counter() - start) * 1000)
+
+    def timed(self, name):
+        # Decorator form of stage() for functions timed on every call
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_duration(self, name, milliseconds):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + milliseconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_emf(self, **properties):
+        with self.lock:
+            durations = {f"{name}Ms": round(value, 3) for name, value in self.durations.items()}
+            counts = dict(self.counts)
+
+        definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in durations]
+        definitions += [{'Name': name, 'Unit': 'Count'} for name in counts]
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service']],
+                    'Metrics': definitions
+                }]
+            },
+            'Service': self.service,
+            **properties,
+            **durations,
+            **counts
+        }
+
+    def flush(self, **properties):
+        # Write the accumulated metrics as one EMF line and start a fresh invocation
+        if METRICS_ENABLED and (self.durations or self.counts):
+            # Printed rather than logged, because the logging prefix would stop CloudWatch parsing the JSON
+            print(json.dumps(self.to_emf(**properties), separators=(',', ':')), flush=True)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}
+            self.counts = {}
+
+    def flush_after_invocation(self, handler):
+        # Decorate a Lambda handler to time it and flush its metrics however it returns
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            properties = {}
+            if context is not None:
+                properties['RequestId'] = getattr(context, 'aws_request_id', None)
+            try:
+                with self.stage('Handler'):
+                    return handler(event, context)
+            finally:
+                self.flush(**properties)
+        return wrapper
@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python'))
+
+from pipeline_metrics import PipelineMetrics
+
+
+def emitted_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_handler_flushes_one_emf_line_with_stages_and_counts(capsys):
+    metrics = PipelineMetrics('test-service', namespace='TestNamespace')
+
+    @metrics.timed('S3Get')
+    def read(key):
+        return key
+
+    @metrics.flush_after_invocation
+    def handler(event, context):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(read, range(8)))
+        metrics.count('ResultFilesRead', 8)
+        metrics.count('ResultFilesRead')
+        return 'ok'
+
+    assert handler({}, None) == 'ok'
+
+    [line] = emitted_lines(capsys)
+    definition = line['_aws']['CloudWatchMetrics'][0]
+    assert definition['Namespace'] == 'TestNamespace'
+    assert definition['Dimensions'] == [['Service']]
+    assert {m['Name']: m['Unit'] for m in definition['Metrics']} == {
+        'S3GetMs': 'Milliseconds',
+        'HandlerMs': 'Milliseconds',
+        'ResultFilesRead': 'Count'
+    }
+    assert line['Service'] == 'test-service'
+    assert line['ResultFilesRead'] == 9
+    assert line['S3GetMs'] >= 0
+
+
+def test_metrics_reset_between_invocations_even_when_handler_raises(capsys):
+    metrics = PipelineMetrics('test-service')
+
+    @metrics.flush_after_invocation
+    def handler(event, context):
+        metrics.count('Attempts')
+        if event.get('fail'):
+            raise ValueError('boom')
+
+    try:
+        handler({'fail': True}, None)
+    except ValueError:
+        pass
+    handler({}, None)
+
+    lines = emitted_lines(capsys)
+    assert [line['Attempts'] for line in lines] == [1, 1]
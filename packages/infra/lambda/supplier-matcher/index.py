@@ -1,170 +1,1227 @@
 import json
+import base64
 import boto3
 import csv
-import io
+import functools
+import gzip
+import heapq
+import itertools
 import os
+import random
+import re
+import sys
+import time
 import traceback
+from collections import OrderedDict
 from typing import List, Dict, Optional, Tuple
-from thefuzz import fuzz, process
+import numpy as np
+from botocore.exceptions import ClientError
+from rapidfuzz import fuzz, process, utils
 import logging
+from pipeline_metrics import PipelineMetrics
 
-# Configure logging
+# Configure logging; DEBUG adds per-row and per-vendor detail
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+# Fraction of invocations whose full request and response payloads are logged (0 disables payload logging)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '0'))
 
 s3_client = boto3.client('s3')
 
+# The index builder function deploys this module too and sets its own Service name, so its stages,
+# including the ones timed inside SupplierMatcher, are not counted as matcher traffic
+metrics = PipelineMetrics(os.environ.get('PIPELINE_METRICS_SERVICE', 'supplier-matcher'))
+
+SUPPLIER_LIST_KEY = 'SupplierList.csv'
+
+# Bytes read from S3 per chunk while streaming the supplier CSV
+CSV_STREAM_CHUNK_BYTES = 64 * 1024
+
+# Bump when the serialized supplier index layout changes so stale artifacts are ignored
+SUPPLIER_INDEX_FORMAT_VERSION = 3
+
+# How long a warm container may reuse a loaded supplier list before re-checking its ETag with a HEAD request
+SUPPLIER_CACHE_MAX_STALENESS_SECONDS = float(os.environ.get('SUPPLIER_CACHE_MAX_STALENESS_SECONDS', '30'))
+
+# Memory budget for supplier lists kept loaded in one warm container; least recently used lists are evicted past it
+SUPPLIER_REGISTRY_MAX_BYTES = int(float(os.environ.get('SUPPLIER_REGISTRY_MAX_MB', '256')) * 1024 * 1024)
+
+# A changed supplier list is patched in place while added + removed + changed rows, and the removed rows
+# still held as tombstones, stay under this fraction of the list; beyond it a full rebuild is cheaper
+SUPPLIER_INCREMENTAL_MAX_CHANGE_FRACTION = float(os.environ.get('SUPPLIER_INCREMENTAL_MAX_CHANGE_FRACTION', '0.2'))
+
+# Upper bound on vendors + BDA results accepted by a single match_vendors_batch request
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', '5000'))
+
+# Worker threads used by rapidfuzz cdist (-1 uses every available core)
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', '-1'))
+
+# Max query x supplier cells scored per cdist call, bounding the float32 score matrix (~4 bytes per cell)
+SCORING_MAX_MATRIX_CELLS = int(os.environ.get('SCORING_MAX_MATRIX_CELLS', '10000000'))
+
+# Supplier lists at least this long get a trigram index; smaller lists are always fully scanned
+CANDIDATE_PRUNING_MIN_SUPPLIERS = int(os.environ.get('CANDIDATE_PRUNING_MIN_SUPPLIERS', '5000'))
+
+# Max suppliers fuzzy-scored per query after trigram pruning
+CANDIDATE_LIMIT = int(os.environ.get('CANDIDATE_LIMIT', '500'))
+
+# Pruned results below this best score are treated as uncertain recall and re-checked with a full scan
+CANDIDATE_CONFIDENT_SCORE = int(os.environ.get('CANDIDATE_CONFIDENT_SCORE', '80'))
+
+# Max vendor match results memoized per loaded supplier list (0 disables the cache)
+MATCH_CACHE_MAX_ENTRIES = int(os.environ.get('MATCH_CACHE_MAX_ENTRIES', '10000'))
+
+# How long a memoized match result may be served
+MATCH_CACHE_TTL_SECONDS = float(os.environ.get('MATCH_CACHE_TTL_SECONDS', '3600'))
+
+# Score histogram buckets reported with include_distribution, as [low, high) edges on the 0-100 scale
+SCORE_DISTRIBUTION_EDGES = (0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 101)
+
+# Bump when the vendor alias table layout or name normalization changes
+VENDOR_ALIAS_FORMAT_VERSION = 3
+
+# Fuzzy matches scoring at least this are recorded as vendor aliases and later resolved by exact lookup
+VENDOR_ALIAS_MIN_SCORE = int(os.environ.get('VENDOR_ALIAS_MIN_SCORE', '95'))
+
+# Max aliases kept in the shared alias table; the oldest are dropped first
+VENDOR_ALIAS_MAX_ENTRIES = int(os.environ.get('VENDOR_ALIAS_MAX_ENTRIES', '50000'))
+
+# Conditional-write attempts when merging new aliases with ones saved by concurrent instances
+VENDOR_ALIAS_SAVE_ATTEMPTS = 3
+
+# Learned aliases are merged into the shared table once this many are pending, or once the oldest has waited
+# this long, instead of on every request; unsaved aliases are simply learned again if the instance is recycled
+VENDOR_ALIAS_FLUSH_MIN_PENDING = int(os.environ.get('VENDOR_ALIAS_FLUSH_MIN_PENDING', '50'))
+VENDOR_ALIAS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('VENDOR_ALIAS_FLUSH_INTERVAL_SECONDS', '60'))
+
+# Exact-key indexes consulted before any fuzzy scoring, as index name -> supplier columns feeding it
+EXACT_INDEX_COLUMNS = {
+    'supplier_code': ('supplier_code',),
+    'cr_number': ('cr_1', 'cr_2'),
+    'aws_vendor': ('aws_vendor',),
+    'normalized_name': ('combined_name',)
+}
+
+# BDA inference_result fields looked up in the identifier indexes, most specific index first
+EXACT_INDEX_FIELDS = {
+    'supplier_code': ['SupplierCode', 'SUPPLIER_CODE', 'VENDOR_CODE', 'supplier_code', 'vendor_code'],
+    'cr_number': [
+        'VendorRegistrationNumber', 'REGISTRATION_NUMBER', 'BUSINESS_REGISTRATION_NUMBER', 'CR_NUMBER',
+        'registration_number', 'business_registration_number', 'cr_number'
+    ]
+}
+
+# Same preprocessing thefuzz applied before token_sort_ratio, so scores stay comparable
+_LATIN1_TRANSLATION = {i: None for i in range(128, 256)}
+
+# Spelled-out company suffixes mapped to one canonical token, so "Acme Limited" and "Acme Ltd" normalize alike
+COMPANY_SUFFIXES = {
+    'limited': 'ltd',
+    'incorporated': 'inc',
+    'corporation': 'corp',
+    'company': 'co',
+    'proprietary': 'pty',
+    'berhad': 'bhd'
+}
+
+# Multi-word suffixes collapsed to one token before the single-word mapping, matched on the processed name
+# ("beschränkter" loses its "ä" to the Latin-1 stripping, so both that and the "ae" spelling are listed)
+COMPANY_SUFFIX_PHRASES = {
+    'gesellschaft mit beschrnkter haftung': 'gmbh',
+    'gesellschaft mit beschraenkter haftung': 'gmbh',
+    'gesellschaft mbh': 'gmbh'
+}
+_COMPANY_SUFFIX_PHRASE_PATTERN = re.compile(
+    r'\b(' + '|'.join(re.escape(phrase) for phrase in sorted(COMPANY_SUFFIX_PHRASES, key=len, reverse=True)) + r')\b'
+)
+
+def log_fields(level: int, message: str, **fields):
+    """Log a message with JSON-encoded fields, serializing them only when the level is enabled"""
+    if logger.isEnabledFor(level):
+        logger.log(level, '%s %s', message, json.dumps(fields, default=str))
+
+def _full_process(name: str) -> str:
+    """Drop Latin-1 characters, lowercase and strip punctuation like thefuzz.utils.full_process"""
+    return utils.default_process(name.translate(_LATIN1_TRANSLATION))
+
+def normalize_company_name(name: str) -> str:
+    """Processed, suffix-canonicalized and sorted tokens, the form token_sort_ratio compares"""
+    processed = _COMPANY_SUFFIX_PHRASE_PATTERN.sub(
+        lambda match: COMPANY_SUFFIX_PHRASES[match.group(1)], ' '.join(_full_process(name).split()))
+    tokens = [COMPANY_SUFFIXES.get(token, token) for token in processed.split()]
+    return ' '.join(sorted(tokens))
+
+def identifier_key(value: str) -> str:
+    """Case- and punctuation-insensitive form of a supplier code or registration number"""
+    return utils.default_process(value).replace(' ', '')
+
+@functools.lru_cache(maxsize=65536)
+def vendor_key(value: str) -> str:
+    """Normalized AWS vendor name; the column is low-cardinality, so most rows are cache hits"""
+    return normalize_company_name(value)
+
+def is_supplier_list_key(key: str) -> bool:
+    """Supplier lists live at SupplierList.csv, or under a per-business-unit prefix such as unit-a/SupplierList.csv"""
+    return key == SUPPLIER_LIST_KEY or key.endswith('/' + SUPPLIER_LIST_KEY)
+
+def supplier_index_key(key: str) -> str:
+    """S3 key of the prebuilt index stored next to a supplier list CSV"""
+    return f"{os.path.splitext(key)[0]}.index.json.gz"
+
+def prebuilt_index_matches(bucket: str, key: str, source_etag: Optional[str]) -> bool:
+    """Whether the prebuilt index next to a supplier list was built from the given CSV ETag, from a HEAD alone"""
+    try:
+        with metrics.stage('S3Head'):
+            head = s3_client.head_object(Bucket=bucket, Key=supplier_index_key(key))
+    except Exception:
+        # Usually a 404 while the builder has not written an index yet
+        return False
+    return bool(source_etag) and head.get('Metadata', {}).get('source-etag') == source_etag
+
+def supplier_alias_key(key: str) -> str:
+    """S3 key of the vendor alias table stored next to a supplier list CSV"""
+    return f"{os.path.splitext(key)[0]}.aliases.json"
+
+def _encode_array(values: np.ndarray) -> str:
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+def _decode_array(encoded: str, dtype) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype=dtype)
+
+def name_trigrams(normalized_name: str) -> set:
+    """Distinct character trigrams of a normalized name, padded so word boundaries count"""
+    padded = f' {normalized_name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Columns of the supplier table, in CSV order followed by the derived matching name
+SUPPLIER_COLUMNS = ('supplier_code', 'name_1', 'name_2', 'group_1', 'group_2', 'cr_1', 'cr_2', 'aws_vendor', 'combined_name')
+
+# Low-cardinality columns whose values are interned so repeated strings are stored once
+_INTERNED_COLUMNS = ('group_1', 'group_2', 'aws_vendor')
+
+class SupplierTable:
+    """Column-oriented supplier records addressed by row index"""
+    
+    def __init__(self):
+        self.columns: Dict[str, List[str]] = {column: [] for column in SUPPLIER_COLUMNS}
+    
+    def __len__(self) -> int:
+        return len(self.columns['supplier_code'])
+    
+    def __getitem__(self, index: int) -> Dict:
+        return {column: values[index] for column, values in self.columns.items()}
+    
+    def append(self, record: Dict) -> int:
+        """Append a supplier record and return its row index"""
+        for column, values in self.columns.items():
+            value = record.get(column, '')
+            values.append(sys.intern(value) if column in _INTERNED_COLUMNS else value)
+        return len(self) - 1
+    
+    def value(self, index: int, column: str) -> str:
+        return self.columns[column][index]
+
+class MatchCache:
+    """LRU cache of match results with a per-entry TTL and hit/miss counters"""
+    
+    def __init__(self, max_entries: int = MATCH_CACHE_MAX_ENTRIES, ttl_seconds: float = MATCH_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def get(self, key: Tuple):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl_seconds:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, key: Tuple, value) -> None:
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def stats(self, since: Optional[Dict] = None) -> Dict:
+        """Hit/miss counts, relative to an earlier stats() snapshot when given"""
+        since = since or {'hits': 0, 'misses': 0}
+        return {
+            'hits': self.hits - since['hits'],
+            'misses': self.misses - since['misses'],
+            'entries': len(self.entries)
+        }
+
 class SupplierMatcher:
     def __init__(self):
-        self.suppliers = []
-        self.supplier_names = []
+        self.suppliers = SupplierTable()
+        self.supplier_names = self.suppliers.columns['combined_name']
+        self.normalized_names = []
+        self.trigram_index: Dict[str, np.ndarray] = {}
+        self.trigram_counts = np.zeros(0, dtype=np.int32)
+        # Supplier code -> row, and rows whose supplier was removed by an incremental update
+        self.rows_by_code: Dict[str, int] = {}
+        self.removed_rows: set = set()
+        # Index name -> exact key -> row, or a list of rows when several suppliers share the key
+        self.exact_indexes: Dict[str, Dict[str, object]] = {name: {} for name in EXACT_INDEX_COLUMNS}
+        # Bumped every time an incremental update is applied on top of the loaded snapshot
+        self.version = 0
+        self.etag = None
+        self.last_modified = None
+        # Lives and dies with this matcher, so a reloaded supplier list starts with an empty cache
+        self.match_cache = MatchCache()
+        # Normalized vendor name -> ranked top rows, with the limit and top threshold they were learned under,
+        # for vendors confirmed by earlier high-confidence matches
+        self.aliases: Dict[str, Dict] = {}
+        # Aliases learned since the table was last saved, keyed the same way but holding supplier codes
+        self.pending_aliases: Dict[str, Dict] = {}
+        # time.monotonic() when the oldest pending alias was learned
+        self.pending_aliases_since: Optional[float] = None
         
-    def load_suppliers_from_s3(self, bucket: str, key: str = 'SupplierList.csv') -> bool:
+    def _parse_suppliers_csv(self, bucket: str, key: str) -> Optional[Tuple[SupplierTable, Dict, Dict]]:
+        """Stream the supplier CSV into a new table, returning (table, S3 response, skipped counts)"""
+        # Stream the CSV from S3 line by line so the raw bytes and decoded text never sit in memory next to the table
+        with metrics.stage('S3Get'):
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+        lines = (
+            line.decode('utf-8')
+            for line in response['Body'].iter_lines(chunk_size=CSV_STREAM_CHUNK_BYTES, keepends=True)
+        )
+        
+        first_line = next(lines, '')
+        if not first_line:
+            logger.error("CSV file is empty")
+            return None
+        
+        # Check if it's the placeholder file
+        if first_line.startswith('# Sample Supplier List Format'):
+            logger.warning("No supplier list uploaded yet")
+            return None
+        
+        # Parse CSV
+        csv_reader = csv.reader(itertools.chain([first_line], lines))
+        
+        # Skip header row explicitly
+        headers = next(csv_reader)
+        logger.info("CSV headers detected and skipped: %s", headers)
+        
+        suppliers = SupplierTable()
+        # Per-reason counts reported once after the load instead of a log line per row
+        skipped = {'not_enough_columns': 0, 'empty_code_or_name': 0, 'header_like': 0}
+        
+        for row_num, row in enumerate(csv_reader, start=2):  # Start from row 2 (after header)
+            # Skip empty rows and rows that don't have enough data
+            if len(row) < 2:
+                skipped['not_enough_columns'] += 1
+                logger.debug("Skipping row %d: not enough columns - %s", row_num, row)
+                continue
+                
+            # Clean and check first two columns
+            supplier_code = row[0].strip() if row[0] else ''
+            supplier_name = row[1].strip() if row[1] else ''
+            
+            if not supplier_code or not supplier_name:
+                skipped['empty_code_or_name'] += 1
+                logger.debug("Skipping row %d: empty supplier code or name - %s", row_num, row)
+                continue
+            
+            # Skip header-like rows (in case there are multiple headers)
+            if supplier_code.lower() in ['supplier', 'supplier_code', 'code'] or supplier_name.lower() in ['name', 'supplier_name', 'name 1']:
+                skipped['header_like'] += 1
+                logger.debug("Skipping header-like row %d: %s", row_num, row)
+                continue
+                
+            supplier_record = {
+                'supplier_code': supplier_code,
+                'name_1': supplier_name,
+                'name_2': row[2].strip() if len(row) > 2 and row[2] else '',
+                'group_1': row[3].strip() if len(row) > 3 and row[3] else '',
+                'group_2': row[4].strip() if len(row) > 4 and row[4] else '',
+                'cr_1': row[5].strip() if len(row) > 5 and row[5] else '',
+                'cr_2': row[6].strip() if len(row) > 6 and row[6] else '',
+                'aws_vendor': row[7].strip() if len(row) > 7 and row[7] else ''
+            }
+            
+            # Create combined name for matching
+            combined_name = supplier_record['name_1']
+            if supplier_record['name_2']:
+                combined_name += ' ' + supplier_record['name_2']
+            
+            supplier_record['combined_name'] = combined_name
+            suppliers.append(supplier_record)
+        
+        return suppliers, response, skipped
+    
+    @metrics.timed('SupplierCsvLoad')
+    def load_suppliers_from_s3(self, bucket: str, key: str = SUPPLIER_LIST_KEY) -> bool:
         """Load supplier list from S3 CSV file"""
         try:
             logger.info(f"Loading suppliers from s3://{bucket}/{key}")
             
-            # Download CSV from S3
-            response = s3_client.get_object(Bucket=bucket, Key=key)
-            csv_content = response['Body'].read().decode('utf-8')
-            
-            # Check if it's the placeholder file
-            if csv_content.startswith('# Sample Supplier List Format'):
-                logger.warning("No supplier list uploaded yet")
+            parsed = self._parse_suppliers_csv(bucket, key)
+            if not parsed:
                 return False
+            self.suppliers, response, skipped = parsed
+            self.supplier_names = self.suppliers.columns['combined_name']
+            self.etag = response.get('ETag')
+            self.last_modified = response.get('LastModified')
             
-            # Parse CSV
-            csv_reader = csv.reader(io.StringIO(csv_content))
+            self._build_index()
+            metrics.count('SuppliersLoaded', len(self.suppliers))
+            metrics.count('SupplierRowsSkipped', sum(skipped.values()))
+            log_fields(logging.INFO, "Successfully loaded suppliers (header row excluded)",
+                       source=f"s3://{bucket}/{key}", suppliers=len(self.suppliers), skipped=skipped)
+            return True
             
-            # Skip header row explicitly
-            try:
-                headers = next(csv_reader)
-                logger.info(f"CSV headers detected and skipped: {headers}")
-            except StopIteration:
-                logger.error("CSV file is empty")
+        except Exception as e:
+            logger.error(f"Error loading suppliers: {str(e)}")
+            return False
+    
+    def to_index_bytes(self) -> bytes:
+        """Serialize the supplier table, normalized names and trigram index as gzipped JSON"""
+        grams = list(self.trigram_index)
+        postings = [self.trigram_index[gram] for gram in grams]
+        offsets = np.cumsum([0] + [len(p) for p in postings], dtype=np.uint64)
+        
+        payload = {
+            'format_version': SUPPLIER_INDEX_FORMAT_VERSION,
+            'source_etag': self.etag,
+            'columns': self.suppliers.columns,
+            'normalized_names': self.normalized_names,
+            'trigrams': grams,
+            # Postings are stored as one flat uint32 array plus offsets so loading is a single frombuffer
+            'posting_offsets': _encode_array(offsets),
+            'postings': _encode_array(np.concatenate(postings) if postings else np.zeros(0, dtype=np.uint32)),
+            'trigram_counts': _encode_array(self.trigram_counts),
+            'exact_indexes': self.exact_indexes
+        }
+        return gzip.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    
+    @metrics.timed('SupplierIndexLoad')
+    def load_index_from_s3(self, bucket: str, key: str, source_etag: str) -> bool:
+        """Load a prebuilt supplier index, accepting it only if it was built from the given CSV ETag"""
+        index_key = supplier_index_key(key)
+        try:
+            with metrics.stage('S3Get'):
+                response = s3_client.get_object(Bucket=bucket, Key=index_key)
+            # Metadata arrives with the headers, so a stale index is rejected before its body is downloaded
+            if response.get('Metadata', {}).get('source-etag') != source_etag:
+                response['Body'].close()
+                logger.info(f"Prebuilt supplier index at s3://{bucket}/{index_key} is stale, ignoring it")
                 return False
-            
-            self.suppliers = []
-            self.supplier_names = []
-            row_count = 0
-            
-            for row_num, row in enumerate(csv_reader, start=2):  # Start from row 2 (after header)
-                # Skip empty rows and rows that don't have enough data
-                if len(row) < 2:
-                    logger.info(f"Skipping row {row_num}: not enough columns - {row}")
-                    continue
-                    
-                # Clean and check first two columns
-                supplier_code = row[0].strip() if row[0] else ''
-                supplier_name = row[1].strip() if row[1] else ''
-                
-                if not supplier_code or not supplier_name:
-                    logger.info(f"Skipping row {row_num}: empty supplier code or name - {row}")
-                    continue
+            with metrics.stage('S3Get'):
+                body = response['Body'].read()
+            payload = json.loads(gzip.decompress(body))
+        except s3_client.exceptions.NoSuchKey:
+            logger.info(f"No prebuilt supplier index at s3://{bucket}/{index_key}")
+            return False
+        except Exception as e:
+            logger.error(f"Error reading supplier index: {str(e)}")
+            return False
+        
+        if payload.get('format_version') != SUPPLIER_INDEX_FORMAT_VERSION or payload.get('source_etag') != source_etag:
+            logger.info(f"Prebuilt supplier index at s3://{bucket}/{index_key} is stale, ignoring it")
+            return False
+        
+        self.suppliers = SupplierTable()
+        for column in SUPPLIER_COLUMNS:
+            values = payload['columns'][column]
+            self.suppliers.columns[column] = [sys.intern(v) for v in values] if column in _INTERNED_COLUMNS else values
+        self.supplier_names = self.suppliers.columns['combined_name']
+        self.normalized_names = payload['normalized_names']
+        
+        offsets = _decode_array(payload['posting_offsets'], np.uint64)
+        postings = _decode_array(payload['postings'], np.uint32)
+        self.trigram_index = {
+            gram: postings[offsets[i]:offsets[i + 1]]
+            for i, gram in enumerate(payload['trigrams'])
+        }
+        self.trigram_counts = _decode_array(payload['trigram_counts'], np.int32)
+        self._index_codes()
+        self.exact_indexes = payload['exact_indexes']
+        
+        metrics.count('SuppliersLoaded', len(self.suppliers))
+        logger.info(f"Loaded {len(self.suppliers)} suppliers from prebuilt index s3://{bucket}/{index_key}")
+        return True
+    
+    def load_suppliers(self, bucket: str, key: str = SUPPLIER_LIST_KEY) -> bool:
+        """Load suppliers from the prebuilt index when it matches the current CSV, else parse the CSV"""
+        try:
+            with metrics.stage('S3Head'):
+                head = s3_client.head_object(Bucket=bucket, Key=key)
+        except Exception as e:
+            logger.error(f"Error checking supplier list: {str(e)}")
+            return False
+        
+        if self.load_index_from_s3(bucket, key, head.get('ETag')):
+            self.etag = head.get('ETag')
+            self.last_modified = head.get('LastModified')
+        elif not self.load_suppliers_from_s3(bucket, key):
+            return False
+        
+        self.load_aliases_from_s3(bucket, key)
+        return True
+    
+    def _alias_rows(self, alias_codes: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Resolve aliased supplier codes to rows, dropping aliases whose top list names a removed supplier"""
+        return {
+            name: {'rows': [self.rows_by_code[code] for code in alias['codes']],
+                   'limit': alias['limit'], 'top_threshold': alias['top_threshold']}
+            for name, alias in alias_codes.items()
+            if all(code in self.rows_by_code for code in alias['codes'])
+        }
+    
+    def _read_alias_table(self, bucket: str, alias_key: str) -> Tuple[Dict[str, Dict], Optional[str]]:
+        """Alias codes and ETag of the stored table, or ({}, None) when there is none"""
+        try:
+            with metrics.stage('S3Get'):
+                response = s3_client.get_object(Bucket=bucket, Key=alias_key)
+                payload = json.loads(response['Body'].read())
+        except s3_client.exceptions.NoSuchKey:
+            return {}, None
+        
+        if payload.get('format_version') != VENDOR_ALIAS_FORMAT_VERSION:
+            logger.info(f"Vendor alias table at s3://{bucket}/{alias_key} has an old format, replacing it")
+            return {}, response.get('ETag')
+        return payload.get('aliases', {}), response.get('ETag')
+    
+    @metrics.timed('VendorAliasLoad')
+    def load_aliases_from_s3(self, bucket: str, key: str = SUPPLIER_LIST_KEY) -> bool:
+        """Load the shared vendor alias table for this supplier list"""
+        alias_key = supplier_alias_key(key)
+        try:
+            alias_codes, _ = self._read_alias_table(bucket, alias_key)
+        except Exception as e:
+            logger.error(f"Error reading vendor alias table: {str(e)}")
+            return False
+        
+        self.aliases = self._alias_rows(alias_codes)
+        logger.info(f"Loaded {len(self.aliases)} vendor aliases from s3://{bucket}/{alias_key}")
+        return True
+    
+    def alias_flush_due(self) -> bool:
+        """Whether enough aliases are pending, or the oldest has waited long enough, to merge them now"""
+        if not self.pending_aliases:
+            return False
+        return (len(self.pending_aliases) >= VENDOR_ALIAS_FLUSH_MIN_PENDING
+                or time.monotonic() - self.pending_aliases_since >= VENDOR_ALIAS_FLUSH_INTERVAL_SECONDS)
+    
+    def save_aliases(self, bucket: str, key: str = SUPPLIER_LIST_KEY, force: bool = False) -> int:
+        """Merge newly learned aliases into the shared alias table when a flush is due (or forced),
+        returning how many were added"""
+        if not (self.pending_aliases and (force or self.alias_flush_due())):
+            return 0
+        return self._save_aliases(bucket, key)
+    
+    @metrics.timed('VendorAliasSave')
+    def _save_aliases(self, bucket: str, key: str) -> int:
+        alias_key = supplier_alias_key(key)
+        for _ in range(VENDOR_ALIAS_SAVE_ATTEMPTS):
+            try:
+                # Re-read on every attempt so aliases saved by concurrent instances are kept
+                alias_codes, etag = self._read_alias_table(bucket, alias_key)
+                merged = {**alias_codes, **self.pending_aliases}
+                if len(merged) > VENDOR_ALIAS_MAX_ENTRIES:
+                    merged = dict(list(merged.items())[-VENDOR_ALIAS_MAX_ENTRIES:])
                 
-                # Skip header-like rows (in case there are multiple headers)
-                if supplier_code.lower() in ['supplier', 'supplier_code', 'code'] or supplier_name.lower() in ['name', 'supplier_name', 'name 1']:
-                    logger.info(f"Skipping header-like row {row_num}: {row}")
+                condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+                with metrics.stage('S3Put'):
+                    s3_client.put_object(
+                        Bucket=bucket,
+                        Key=alias_key,
+                        Body=json.dumps({'format_version': VENDOR_ALIAS_FORMAT_VERSION, 'aliases': merged},
+                                        separators=(',', ':')),
+                        ContentType='application/json',
+                        **condition
+                    )
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
                     continue
-                    
-                supplier_record = {
-                    'supplier_code': supplier_code,
-                    'name_1': supplier_name,
-                    'name_2': row[2].strip() if len(row) > 2 and row[2] else '',
-                    'group_1': row[3].strip() if len(row) > 3 and row[3] else '',
-                    'group_2': row[4].strip() if len(row) > 4 and row[4] else '',
-                    'cr_1': row[5].strip() if len(row) > 5 and row[5] else '',
-                    'cr_2': row[6].strip() if len(row) > 6 and row[6] else '',
-                    'aws_vendor': row[7].strip() if len(row) > 7 and row[7] else ''
-                }
-                
-                # Create combined name for matching
-                combined_name = supplier_record['name_1']
-                if supplier_record['name_2']:
-                    combined_name += ' ' + supplier_record['name_2']
-                
-                supplier_record['combined_name'] = combined_name
-                self.suppliers.append(supplier_record)
-                self.supplier_names.append(combined_name)
-                row_count += 1
-                
-                logger.info(f"Added supplier {row_count}: {supplier_code} - {combined_name}")
-            
-            logger.info(f"Successfully loaded {len(self.suppliers)} suppliers (header row excluded)")
-            return True
+                logger.error(f"Error saving vendor alias table: {str(e)}")
+                return 0
+            except Exception as e:
+                logger.error(f"Error saving vendor alias table: {str(e)}")
+                return 0
             
+            added = len(self.pending_aliases)
+            self.aliases = self._alias_rows(merged)
+            self.pending_aliases = {}
+            self.pending_aliases_since = None
+            logger.info(f"Saved {added} new vendor aliases to s3://{bucket}/{alias_key}")
+            return added
+        
+        logger.warning(f"Gave up saving vendor aliases to s3://{bucket}/{alias_key} after concurrent updates")
+        return 0
+    
+    @metrics.timed('IndexBuild')
+    def _build_index(self):
+        """Normalize every supplier name once so queries only score against precomputed forms"""
+        self.normalized_names = [normalize_company_name(name) for name in self.supplier_names]
+        self.trigram_index = {}
+        self.trigram_counts = np.zeros(len(self.normalized_names), dtype=np.int32)
+        self._index_codes()
+        self._build_exact_indexes()
+        
+        if len(self.normalized_names) < CANDIDATE_PRUNING_MIN_SUPPLIERS:
+            return
+        
+        # Inverted index from trigram to the suppliers containing it, used to prune candidates per query
+        postings: Dict[str, List[int]] = {}
+        for index, name in enumerate(self.normalized_names):
+            grams = name_trigrams(name)
+            self.trigram_counts[index] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(index)
+        
+        self.trigram_index = {gram: np.array(indices, dtype=np.uint32) for gram, indices in postings.items()}
+        logger.info(f"Built trigram index with {len(self.trigram_index)} trigrams")
+    
+    def _index_codes(self):
+        """Map supplier codes to rows for a freshly loaded table; duplicate codes resolve to the first row"""
+        self.rows_by_code = {}
+        self.removed_rows = set()
+        for index, code in enumerate(self.suppliers.columns['supplier_code']):
+            self.rows_by_code.setdefault(code, index)
+    
+    def _exact_keys(self, index: int):
+        """(index name, key) pairs under which one row is found in the exact indexes"""
+        for index_name, columns in EXACT_INDEX_COLUMNS.items():
+            if index_name == 'normalized_name':
+                keys = {self.normalized_names[index]}
+            else:
+                key_of = vendor_key if index_name == 'aws_vendor' else identifier_key
+                keys = {key_of(value) for value in (self.suppliers.value(index, c) for c in columns) if value}
+            for key in keys:
+                if key:
+                    yield index_name, key
+    
+    @staticmethod
+    def _add_exact_key(exact_index: Dict[str, object], key: str, index: int):
+        rows = exact_index.get(key)
+        if rows is None:
+            exact_index[key] = index
+        elif isinstance(rows, list):
+            rows.append(index)
+        else:
+            exact_index[key] = [rows, index]
+    
+    def _index_exact(self, index: int):
+        for index_name, key in self._exact_keys(index):
+            self._add_exact_key(self.exact_indexes[index_name], key, index)
+    
+    def _unindex_exact(self, index: int):
+        for index_name, key in self._exact_keys(index):
+            exact_index = self.exact_indexes[index_name]
+            rows = exact_index.get(key)
+            if not isinstance(rows, list):
+                exact_index.pop(key, None)
+                continue
+            rows.remove(index)
+            if len(rows) == 1:
+                exact_index[key] = rows[0]
+    
+    @metrics.timed('ExactIndexBuild')
+    def _build_exact_indexes(self):
+        """Hash indexes over supplier code, CR numbers, AWS vendor and normalized name"""
+        self.exact_indexes = {name: {} for name in EXACT_INDEX_COLUMNS}
+        # Keys are computed a column at a time rather than via _index_exact per row, which dominates load time
+        for index_name, columns in EXACT_INDEX_COLUMNS.items():
+            exact_index = self.exact_indexes[index_name]
+            if index_name == 'normalized_name':
+                key_columns = [self.normalized_names]
+            else:
+                key_of = vendor_key if index_name == 'aws_vendor' else identifier_key
+                key_columns = [[key_of(value) if value else '' for value in self.suppliers.columns[c]] for c in columns]
+            for index, keys in enumerate(zip(*key_columns)):
+                for key in set(keys):
+                    if key:
+                        self._add_exact_key(exact_index, key, index)
+    
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the supplier table and its indexes, for the matcher registry budget"""
+        size = 0
+        for column, values in self.suppliers.columns.items():
+            # Interned values are shared, so each distinct string is counted once
+            strings = set(values) if column in _INTERNED_COLUMNS else values
+            size += sys.getsizeof(values) + sum(map(sys.getsizeof, strings))
+        size += sys.getsizeof(self.normalized_names) + sum(map(sys.getsizeof, self.normalized_names))
+        size += sys.getsizeof(self.trigram_index) + self.trigram_counts.nbytes
+        size += sum(sys.getsizeof(postings) for postings in self.trigram_index.values())
+        size += sys.getsizeof(self.rows_by_code)
+        for exact_index in self.exact_indexes.values():
+            size += sys.getsizeof(exact_index) + sum(map(sys.getsizeof, exact_index))
+        return size
+    
+    def supplier_count(self) -> int:
+        """Suppliers currently matchable, excluding rows removed by incremental updates"""
+        return len(self.suppliers) - len(self.removed_rows)
+    
+    def _unindex_row(self, index: int):
+        """Drop one row from the trigram postings"""
+        if not self.trigram_index:
+            return
+        for gram in name_trigrams(self.normalized_names[index]):
+            postings = self.trigram_index.get(gram)
+            if postings is not None:
+                self.trigram_index[gram] = postings[postings != index]
+    
+    def _index_row(self, index: int):
+        """Normalize one row and add it to the trigram postings"""
+        name = normalize_company_name(self.supplier_names[index])
+        self.normalized_names[index] = name
+        if not self.trigram_index:
+            return
+        grams = name_trigrams(name)
+        self.trigram_counts[index] = len(grams)
+        for gram in grams:
+            postings = self.trigram_index.get(gram)
+            row = np.array([index], dtype=np.uint32)
+            self.trigram_index[gram] = row if postings is None else np.concatenate([postings, row])
+    
+    @metrics.timed('SupplierIncrementalUpdate')
+    def update_suppliers_from_s3(self, bucket: str, key: str = SUPPLIER_LIST_KEY) -> bool:
+        """Patch the loaded snapshot with the rows that changed in the CSV, keyed by supplier code
+        
+        Only added, removed and changed rows are re-normalized and re-indexed; removed rows become
+        tombstones. Returns False when the change is too large or ambiguous (duplicate codes,
+        crossing the pruning size) and the caller should rebuild from scratch.
+        """
+        try:
+            parsed = self._parse_suppliers_csv(bucket, key)
         except Exception as e:
-            logger.error(f"Error loading suppliers: {str(e)}")
+            logger.error(f"Error reading supplier list for incremental update: {str(e)}")
+            return False
+        if not parsed:
+            return False
+        new_table, response, skipped = parsed
+        
+        new_rows: Dict[str, int] = {}
+        for index, code in enumerate(new_table.columns['supplier_code']):
+            if new_rows.setdefault(code, index) != index:
+                logger.info(f"Duplicate supplier code {code} in s3://{bucket}/{key}, rebuilding instead of patching")
+                return False
+        if len(self.rows_by_code) != self.supplier_count():
             return False
+        
+        removed = [row for code, row in self.rows_by_code.items() if code not in new_rows]
+        added = []
+        changed = []
+        for code, new_index in new_rows.items():
+            row = self.rows_by_code.get(code)
+            if row is None:
+                added.append(new_index)
+            elif any(self.suppliers.columns[c][row] != new_table.columns[c][new_index] for c in SUPPLIER_COLUMNS):
+                changed.append((row, new_index))
+        
+        total_rows = len(self.suppliers) + len(added)
+        touched = len(added) + len(removed) + len(changed)
+        if (touched > SUPPLIER_INCREMENTAL_MAX_CHANGE_FRACTION * max(len(new_rows), 1)
+                or len(self.removed_rows) + len(removed) > SUPPLIER_INCREMENTAL_MAX_CHANGE_FRACTION * total_rows
+                or bool(self.trigram_index) != (len(new_rows) >= CANDIDATE_PRUNING_MIN_SUPPLIERS)):
+            logger.info(f"Supplier list change touches {touched} rows, rebuilding instead of patching")
+            return False
+        
+        # Prebuilt indexes load counts as a read-only buffer, so take a writable copy sized for the new rows
+        self.trigram_counts = np.concatenate([self.trigram_counts, np.zeros(len(added), dtype=np.int32)])
+        
+        for row in removed:
+            self._unindex_row(row)
+            self._unindex_exact(row)
+            del self.rows_by_code[self.suppliers.value(row, 'supplier_code')]
+            self.normalized_names[row] = ''
+            self.trigram_counts[row] = 0
+            self.removed_rows.add(row)
+        
+        for row, new_index in changed:
+            self._unindex_row(row)
+            self._unindex_exact(row)
+            for column, values in self.suppliers.columns.items():
+                value = new_table.columns[column][new_index]
+                values[row] = sys.intern(value) if column in _INTERNED_COLUMNS else value
+            self._index_row(row)
+            self._index_exact(row)
+        
+        for new_index in added:
+            row = self.suppliers.append(new_table[new_index])
+            self.normalized_names.append('')
+            self.rows_by_code[self.suppliers.value(row, 'supplier_code')] = row
+            self._index_row(row)
+            self._index_exact(row)
+        
+        removed_set = set(removed)
+        self.aliases = {name: alias for name, alias in self.aliases.items() if removed_set.isdisjoint(alias['rows'])}
+        self.pending_aliases = {name: alias for name, alias in self.pending_aliases.items()
+                                if all(code in self.rows_by_code for code in alias['codes'])}
+        # Cached matches are keyed by the old ETag and may point at changed rows
+        self.match_cache = MatchCache()
+        self.etag = response.get('ETag')
+        self.last_modified = response.get('LastModified')
+        self.version += 1
+        
+        metrics.count('SupplierRowsAdded', len(added))
+        metrics.count('SupplierRowsRemoved', len(removed))
+        metrics.count('SupplierRowsChanged', len(changed))
+        metrics.count('SupplierRowsSkipped', sum(skipped.values()))
+        log_fields(logging.INFO, "Applied incremental supplier list update",
+                   source=f"s3://{bucket}/{key}", version=self.version, added=len(added),
+                   removed=len(removed), changed=len(changed), suppliers=self.supplier_count())
+        return True
     
-    def find_best_match(self, vendor_name: str, threshold: int = 60) -> Optional[Dict]:
-        """Find best supplier match using thefuzz"""
-        if not vendor_name or not self.supplier_names:
+    def _candidate_indices(self, normalized_query: str) -> Optional[np.ndarray]:
+        """Suppliers sharing the most trigrams with the query, or None when the full list must be scanned"""
+        query_grams = name_trigrams(normalized_query)
+        postings = [self.trigram_index[gram] for gram in query_grams if gram in self.trigram_index]
+        if not postings:
             return None
         
-        logger.info(f"Finding match for vendor: {vendor_name}")
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.normalized_names))
+        # Dice overlap so long supplier names don't crowd out short, closer ones
+        overlap = 2.0 * shared / (len(query_grams) + self.trigram_counts)
+        
+        candidates = np.flatnonzero(shared)
+        if len(candidates) > CANDIDATE_LIMIT:
+            candidates = candidates[np.argpartition(overlap[candidates], -CANDIDATE_LIMIT)[-CANDIDATE_LIMIT:]]
         
-        # Use thefuzz to find best match
-        best_match = process.extractOne(
-            vendor_name, 
-            self.supplier_names,
-            scorer=fuzz.token_sort_ratio  # Good for company names with different word orders
+        # Keep list order so ties still resolve to the earliest supplier
+        return np.sort(candidates)
+    
+    def _score_matrix(self, normalized_queries: List[str], choices: Optional[List[str]] = None,
+                      score_cutoff: float = 0) -> np.ndarray:
+        """Score every vendor against every supplier in one native, multi-threaded cdist call
+        
+        Pairs below score_cutoff come back as 0, letting rapidfuzz abandon them early.
+        """
+        choices = self.normalized_names if choices is None else choices
+        metrics.count('CandidatesScored', len(normalized_queries) * len(choices))
+        # Both sides are already token-sorted, so plain ratio equals token_sort_ratio without re-tokenizing
+        return process.cdist(
+            normalized_queries,
+            choices,
+            scorer=fuzz.ratio,
+            processor=None,
+            dtype=np.float32,
+            workers=SCORING_WORKERS,
+            score_cutoff=score_cutoff
         )
+    
+    def _ranked_matches(self, scores: np.ndarray, limit: int, threshold: int) -> List[Tuple[int, int]]:
+        """Top (supplier index, rounded score) pairs from one row of the score matrix"""
+        # Rank on raw scores with ties broken by list order, filter on rounded scores
+        candidates = np.flatnonzero(scores >= threshold - 0.5)
+        # Partition only the survivors: under a score cutoff most of the row is 0, which selection handles badly
+        if limit < len(candidates):
+            candidate_scores = scores[candidates]
+            kth = np.partition(candidate_scores, len(candidates) - limit)[len(candidates) - limit]
+            candidates = candidates[candidate_scores >= kth]
+        
+        # Bounded heap: ties at the cutoff can leave many candidates, but only `limit` of them are ever ordered
+        ranked = heapq.nsmallest(limit, candidates, key=lambda i: (-scores[i], i))
+        
+        results = []
+        for index in ranked:
+            score = int(round(float(scores[index])))
+            # Rounding is monotonic, so once one ranked score falls below the threshold the rest do too
+            if score < threshold:
+                break
+            results.append((int(index), score))
+        return results
+    
+    def _score_distribution(self, scores: np.ndarray) -> Dict:
+        """How many suppliers fall in each score bucket for one vendor"""
+        counts, _ = np.histogram(scores, bins=SCORE_DISTRIBUTION_EDGES)
+        labels = [f"{low}-{high - 1}" for low, high in zip(SCORE_DISTRIBUTION_EDGES, SCORE_DISTRIBUTION_EDGES[1:])]
+        return {
+            'suppliers_scored': int(counts.sum()),
+            'buckets': dict(zip(labels, (int(c) for c in counts)))
+        }
+    
+    def _match_record(self, index: int, score: int) -> Dict:
+        """Match result for a supplier row; rows are addressed by index so duplicate names keep their own codes"""
+        return {
+            'supplier_code': self.suppliers.value(index, 'supplier_code'),
+            'supplier_name': self.suppliers.value(index, 'combined_name'),
+            'similarity_score': score,
+            'match_type': 'fuzzy'
+        }
+    
+    def _build_match(self, vendor_name: str, ranked: List[Tuple[int, int]], limit: int, threshold: int,
+                     top_threshold: int) -> Tuple[Optional[Dict], List[Dict]]:
+        best_match = None
+        if ranked and ranked[0][1] >= threshold:
+            best_match = self._match_record(*ranked[0])
+            best_match['vendor_name_extracted'] = vendor_name
+        
+        top_matches = [self._match_record(index, score) for index, score in ranked[:limit] if score >= top_threshold]
+        return best_match, top_matches
+    
+    def _alias_match(self, vendor_name: str, query: str, limit: int, threshold: int,
+                     top_threshold: int) -> Optional[Tuple[Optional[Dict], List[Dict]]]:
+        """Best and top matches from the vendor alias table, skipping fuzzy scoring entirely
+        
+        The alias keeps the ranked top list it was learned with, so it answers a request only when that list
+        covers it: no more matches than were learned and none scoring below the learned top threshold.
+        Anything else falls through to scoring, so alias hits return the same top_matches a scan would.
+        """
+        alias = self.aliases.get(query)
+        if alias is None or limit > alias['limit'] or top_threshold < alias['top_threshold']:
+            return None
+        
+        # One ratio per listed supplier keeps the reported scores consistent with fuzzy matches
+        ranked = [(row, int(round(fuzz.ratio(query, self.normalized_names[row])))) for row in alias['rows']]
+        if ranked[0][1] < max(threshold, top_threshold):
+            return None
+        
+        best_match, top_matches = self._build_match(vendor_name, ranked, limit, threshold, top_threshold)
+        best_match['match_type'] = 'alias'
+        if top_matches:
+            top_matches[0]['match_type'] = 'alias'
+        return best_match, top_matches
+    
+    def _exact_match(self, vendor_name: str, index_name: str, key: str,
+                     limit: int = 3) -> Optional[Tuple[Optional[Dict], List[Dict]]]:
+        """Best and top match from one exact-key index, or None when the key is missing or ambiguous"""
+        rows = self.exact_indexes[index_name].get(key) if key else None
+        if rows is None:
+            return None
+        if isinstance(rows, list):
+            # Suppliers sharing a name resolve like a fuzzy tie, to the earliest row; a shared identifier is ambiguous
+            if index_name != 'normalized_name':
+                return None
+            rows = sorted(rows)
+        else:
+            rows = [rows]
+        
+        top_matches = []
+        for row in rows[:max(limit, 1)]:
+            match = self._match_record(row, 100)
+            match['match_type'] = 'exact'
+            match['matched_index'] = index_name
+            top_matches.append(match)
+        return {**top_matches[0], 'vendor_name_extracted': vendor_name}, top_matches
+    
+    def match_identifiers(self, identifiers: Dict[str, str], vendor_name: str = '',
+                          limit: int = 3) -> Optional[Tuple[Optional[Dict], List[Dict]]]:
+        """Resolve a supplier from exact identifiers such as a supplier code or CR number, without scoring"""
+        for index_name, value in identifiers.items():
+            match = self._exact_match(vendor_name, index_name, identifier_key(value), limit)
+            if match:
+                return match
+        return None
+    
+    def with_alternatives(self, exact_match: Tuple[Optional[Dict], List[Dict]], alternatives: List[Dict],
+                          limit: int = 3) -> Tuple[Optional[Dict], List[Dict]]:
+        """An exact match with its free top_matches slots filled from fuzzy alternatives
+        
+        An exact key usually names one supplier, and the next-best fuzzy candidates are still worth showing,
+        so an exact hit reports as many top matches as a fuzzy match of the same input would.
+        """
+        best_match, top_matches = exact_match
+        listed = {(m['supplier_code'], m['supplier_name']) for m in top_matches}
+        extra = [dict(m) for m in alternatives if (m['supplier_code'], m['supplier_name']) not in listed]
+        return best_match, (top_matches + extra)[:max(limit, len(top_matches))]
+    
+    def _copy_match(self, vendor_name: str, match: Tuple[Optional[Dict], List[Dict]]) -> Tuple[Optional[Dict], List[Dict]]:
+        """Copy of a memoized match, so cached entries never share dicts with a response"""
+        best_match, top_matches = match
+        if best_match:
+            # Vendor names that normalize alike share an entry, so the extracted name is per call
+            best_match = {**best_match, 'vendor_name_extracted': vendor_name}
+        return best_match, [dict(m) for m in top_matches]
+    
+    @metrics.timed('Scoring')
+    def match_all(self, vendor_names: List[str], limit: int = 3, threshold: int = 60, top_threshold: int = 50,
+                  include_distribution: bool = False, deadline: Optional[float] = None) -> List[Dict]:
+        """Best match, top N and optionally the score distribution for many vendor names from one scoring pass
+        
+        Each vendor is resolved by the cheapest tier that can answer it: exact indexes, alias table or
+        match cache, candidate-pruned fuzzy pass, then full scan; match_tier reports which one did.
+        Exact hits with fewer than `limit` rows still take the later tiers to fill their top_matches.
+        With a deadline (a time.monotonic() timestamp) scoring stops once it passes and vendors keep the
+        best result found so far. Results cut short are not cached.
+        
+        A distribution needs every supplier's score, so with include_distribution the exact indexes,
+        alias table, match cache and candidate pruning are bypassed and each vendor gets one full scan.
+        """
+        results: List[Tuple[Optional[Dict], List[Dict]]] = [(None, []) for _ in vendor_names]
+        distributions: Dict[int, Dict] = {}
+        tiers: Dict[int, str] = {}
+        if not self.supplier_names:
+            return self._match_dicts(results, distributions, tiers, include_distribution)
         
-        if best_match and best_match[1] >= threshold:
-            matched_name, score = best_match
+        # Recurring vendors are answered from the match cache without scoring
+        queries = {}
+        cache_keys = {}
+        cache_hits = 0
+        alias_hits = 0
+        exact_hits = 0
+        exact_matches = {}
+        for position, name in enumerate(vendor_names):
+            if not name:
+                continue
+            query = normalize_company_name(name)
+            cache_key = (self.etag, query, limit, threshold, top_threshold)
+            if include_distribution:
+                queries[position] = query
+                cache_keys[position] = cache_key
+                continue
+            # An exact normalized-name or AWS vendor hit is certain; it is only scored for its remaining top slots
+            exact_match = (self._exact_match(name, 'normalized_name', query, limit)
+                           or self._exact_match(name, 'aws_vendor', query, limit))
+            if exact_match:
+                results[position] = exact_match
+                tiers[position] = 'exact'
+                exact_hits += 1
+                if len(exact_match[1]) >= limit:
+                    continue
+                exact_matches[position] = exact_match
+            alias_match = self._alias_match(name, query, limit, threshold, top_threshold)
+            if alias_match:
+                results[position] = alias_match
+                tiers[position] = 'alias'
+                alias_hits += 1
+                continue
+            cached = self.match_cache.get(cache_key)
+            if cached is None:
+                queries[position] = query
+                cache_keys[position] = cache_key
+            else:
+                results[position] = self._copy_match(name, cached)
+                tiers[position] = 'cache'
+                cache_hits += 1
+        metrics.count('ExactIndexHits', exact_hits)
+        metrics.count('VendorAliasHits', alias_hits)
+        metrics.count('MatchCacheHits', cache_hits)
+        metrics.count('VendorsScored', len(queries))
+        
+        rank_limit = max(limit, 1)
+        rank_threshold = min(threshold, top_threshold)
+        # Lowest raw score that still rounds up to the threshold; a distribution needs every raw score
+        score_cutoff = 0 if include_distribution else max(rank_threshold - 0.5, 0)
+        
+        # Positions whose result is final, as opposed to a pruned result awaiting its full-scan re-check
+        complete = set()
+        timed_out = False
+        full_scan = []
+        for position, query in queries.items():
+            if deadline is not None and time.monotonic() >= deadline:
+                timed_out = True
+                break
+            candidates = self._candidate_indices(query) if self.trigram_index and not include_distribution else None
+            if candidates is None:
+                full_scan.append(position)
+                continue
             
-            # Find the supplier record
-            supplier_record = next(
-                (s for s in self.suppliers if s['combined_name'] == matched_name), 
-                None
-            )
+            row = self._score_matrix([query], [self.normalized_names[i] for i in candidates], score_cutoff)[0]
+            ranked = [(int(candidates[i]), score) for i, score in self._ranked_matches(row, rank_limit, rank_threshold)]
+            
+            # Kept as the best so far in case the deadline passes before the full-scan re-check
+            results[position] = self._build_match(vendor_names[position], ranked, limit, threshold, top_threshold)
+            tiers[position] = 'pruned'
             
-            if supplier_record:
-                result = {
-                    'supplier_code': supplier_record['supplier_code'],
-                    'supplier_name': supplier_record['combined_name'],
-                    'similarity_score': score,
-                    'match_type': 'fuzzy',
-                    'vendor_name_extracted': vendor_name
+            # Recall is uncertain when pruning finds no confident match, so re-check against the full list
+            if not ranked or ranked[0][1] < max(threshold, CANDIDATE_CONFIDENT_SCORE):
+                full_scan.append(position)
+                continue
+            complete.add(position)
+        
+        # Score in row chunks so the matrix stays within SCORING_MAX_MATRIX_CELLS
+        chunk_size = max(1, SCORING_MAX_MATRIX_CELLS // len(self.supplier_names))
+        removed_rows = np.fromiter(self.removed_rows, dtype=np.int64) if self.removed_rows else None
+        
+        for chunk_start in range(0, len(full_scan), chunk_size):
+            if deadline is not None and time.monotonic() >= deadline:
+                timed_out = True
+                break
+            chunk = full_scan[chunk_start:chunk_start + chunk_size]
+            matrix = self._score_matrix([queries[i] for i in chunk], score_cutoff=score_cutoff)
+            if removed_rows is not None:
+                # Scores below zero never rank and fall outside every distribution bucket
+                matrix[:, removed_rows] = -1
+            
+            for row, position in zip(matrix, chunk):
+                ranked = self._ranked_matches(row, rank_limit, rank_threshold)
+                results[position] = self._build_match(vendor_names[position], ranked, limit, threshold, top_threshold)
+                tiers[position] = 'full'
+                complete.add(position)
+                if include_distribution:
+                    distributions[position] = self._score_distribution(row)
+        
+        if timed_out:
+            metrics.count('MatchDeadlineExceeded')
+            logger.warning("Match deadline passed with %d of %d vendors unresolved",
+                           len(queries) - len(complete), len(vendor_names))
+        
+        for position, cache_key in cache_keys.items():
+            if position not in complete:
+                continue
+            self.match_cache.put(cache_key, self._copy_match(vendor_names[position], results[position]))
+            best_match, top_matches = results[position]
+            if (position not in exact_matches and top_matches and best_match
+                    and best_match['similarity_score'] >= VENDOR_ALIAS_MIN_SCORE):
+                self.pending_aliases[queries[position]] = {
+                    'codes': [match['supplier_code'] for match in top_matches],
+                    'limit': limit,
+                    'top_threshold': top_threshold
                 }
-                
-                logger.info(f"Match found: {supplier_record['supplier_code']} ({score}%)")
-                return result
+                if self.pending_aliases_since is None:
+                    self.pending_aliases_since = time.monotonic()
         
-        logger.info(f"No match found for: {vendor_name}")
-        return None
+        for position, exact_match in exact_matches.items():
+            # Scoring cut short by the deadline leaves the exact result alone
+            if results[position] is not exact_match:
+                results[position] = self.with_alternatives(exact_match, results[position][1], limit)
+                tiers[position] = 'exact'
+        
+        return self._match_dicts(results, distributions, tiers, include_distribution)
+    
+    def _match_dicts(self, results: List[Tuple[Optional[Dict], List[Dict]]], distributions: Dict[int, Dict],
+                     tiers: Dict[int, str], include_distribution: bool) -> List[Dict]:
+        matches = []
+        for position, (best_match, top_matches) in enumerate(results):
+            match = {'best_match': best_match, 'top_matches': top_matches, 'match_tier': tiers.get(position)}
+            if include_distribution:
+                match['score_distribution'] = distributions.get(position)
+            matches.append(match)
+        return matches
+    
+    def match(self, vendor_name: str, limit: int = 3, threshold: int = 60, top_threshold: int = 50,
+              include_distribution: bool = False, deadline: Optional[float] = None) -> Dict:
+        """Best match, top N and optionally the score distribution for one vendor name from a single scan"""
+        return self.match_all([vendor_name], limit, threshold, top_threshold, include_distribution, deadline)[0]
+    
+    def match_many(self, vendor_names: List[str], limit: int = 3, threshold: int = 60,
+                   top_threshold: int = 50) -> List[Tuple[Optional[Dict], List[Dict]]]:
+        """(best match, top N matches) pairs for many vendor names from a single scoring pass"""
+        return [(m['best_match'], m['top_matches']) for m in self.match_all(vendor_names, limit, threshold, top_threshold)]
+    
+    def find_best_match(self, vendor_name: str, threshold: int = 60) -> Optional[Dict]:
+        """Find best supplier match"""
+        if not vendor_name or not self.supplier_names:
+            return None
+        
+        best_match = self.match(vendor_name, limit=1, threshold=threshold, top_threshold=threshold)['best_match']
+        if best_match:
+            logger.debug("Match found for %s: %s (%s%%)", vendor_name, best_match['supplier_code'], best_match['similarity_score'])
+        else:
+            logger.debug("No match found for: %s", vendor_name)
+        return best_match
     
     def find_top_matches(self, vendor_name: str, limit: int = 3, threshold: int = 50) -> List[Dict]:
         """Find top N supplier matches"""
         if not vendor_name or not self.supplier_names:
             return []
         
-        # Get top matches
-        top_matches = process.extract(
-            vendor_name,
-            self.supplier_names,
-            scorer=fuzz.token_sort_ratio,
-            limit=limit
-        )
+        return self.match(vendor_name, limit=limit, threshold=threshold, top_threshold=threshold)['top_matches']
+
+class MatcherRegistry:
+    """Loaded matchers keyed by (bucket, key, version), evicting least recently used lists past a memory budget"""
+    
+    def __init__(self, max_bytes: int = SUPPLIER_REGISTRY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        # (bucket, key) -> ETag of the version currently loaded; a list only ever has one live version
+        self.versions: Dict[Tuple[str, str], str] = {}
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def total_bytes(self) -> int:
+        return sum(entry['size_bytes'] for entry in self.entries.values())
+    
+    def get(self, bucket: str, key: str) -> Optional[Dict]:
+        """Entry for the loaded version of a list, marking it most recently used"""
+        version = self.versions.get((bucket, key))
+        if version is None:
+            return None
+        registry_key = (bucket, key, version)
+        self.entries.move_to_end(registry_key)
+        return self.entries[registry_key]
+    
+    def put(self, bucket: str, key: str, matcher: SupplierMatcher, checked_at: float) -> None:
+        """Register a freshly loaded or updated matcher, replacing any older version of the same list"""
+        self.remove(bucket, key)
+        registry_key = (bucket, key, matcher.etag)
+        self.entries[registry_key] = {'matcher': matcher, 'checked_at': checked_at, 'size_bytes': matcher.memory_bytes()}
+        self.versions[(bucket, key)] = matcher.etag
         
-        results = []
-        for matched_name, score in top_matches:
-            if score >= threshold:
-                supplier_record = next(
-                    (s for s in self.suppliers if s['combined_name'] == matched_name),
-                    None
-                )
-                
-                if supplier_record:
-                    results.append({
-                        'supplier_code': supplier_record['supplier_code'],
-                        'supplier_name': supplier_record['combined_name'],
-                        'similarity_score': score,
-                        'match_type': 'fuzzy'
-                    })
+        total = self.total_bytes()
+        while total > self.max_bytes and len(self.entries) > 1:
+            (evicted_bucket, evicted_key, _), evicted = self.entries.popitem(last=False)
+            del self.versions[(evicted_bucket, evicted_key)]
+            total -= evicted['size_bytes']
+            metrics.count('SupplierListEvictions')
+            logger.info(f"Evicted supplier list s3://{evicted_bucket}/{evicted_key} "
+                        f"({evicted['size_bytes'] // 1024} KiB) to stay within the registry budget")
+        if total > self.max_bytes:
+            logger.warning(f"Supplier list s3://{bucket}/{key} alone needs {total // 1024} KiB, "
+                           f"over the {self.max_bytes // 1024} KiB registry budget")
+    
+    def remove(self, bucket: str, key: str) -> None:
+        version = self.versions.pop((bucket, key), None)
+        if version is not None:
+            self.entries.pop((bucket, key, version), None)
+
+# Loaded matchers kept across warm invocations, so one container can serve several supplier lists
+_matcher_registry = MatcherRegistry()
+
+def get_supplier_matcher(bucket: str, key: str = SUPPLIER_LIST_KEY) -> Optional[SupplierMatcher]:
+    """Return a loaded matcher from the registry, reusing it while the S3 object is unchanged"""
+    cached = _matcher_registry.get(bucket, key)
+    now = time.monotonic()
+    
+    if cached:
+        matcher = cached['matcher']
+        if now - cached['checked_at'] < SUPPLIER_CACHE_MAX_STALENESS_SECONDS:
+            return matcher
         
-        return results
+        # Cheap HEAD to detect a new upload before paying for a full download and parse
+        try:
+            with metrics.stage('S3Head'):
+                head = s3_client.head_object(Bucket=bucket, Key=key)
+        except Exception as e:
+            # A reload would need S3 too, so keep serving the warm list and check again after the staleness window
+            logger.error(f"Error checking supplier list version, serving the loaded list: {str(e)}")
+            cached['checked_at'] = now
+            return matcher
+        
+        if head.get('ETag') == matcher.etag and head.get('LastModified') == matcher.last_modified:
+            cached['checked_at'] = now
+            return matcher
+        logger.info(f"Supplier list s3://{bucket}/{key} changed (ETag {matcher.etag} -> {head.get('ETag')}), updating")
+        if prebuilt_index_matches(bucket, key, head.get('ETag')):
+            # The index builder has caught up, and loading its output beats re-parsing the CSV to diff it
+            logger.info("Prebuilt supplier index matches the new list, reloading from it")
+        else:
+            try:
+                # Patch the warm matcher with just the changed rows; fall through to a full rebuild if that is not possible
+                if matcher.update_suppliers_from_s3(bucket, key):
+                    _matcher_registry.put(bucket, key, matcher, now)
+                    return matcher
+            except Exception as e:
+                logger.error(f"Error updating supplier list in place: {str(e)}")
+    
+    # Drop the stale version first so it is not held in memory alongside the reload
+    _matcher_registry.remove(bucket, key)
+    cached = None
+    matcher = SupplierMatcher()
+    if not matcher.load_suppliers(bucket, key):
+        return None
+    
+    metrics.count('SupplierListLoads')
+    _matcher_registry.put(bucket, key, matcher, now)
+    return matcher
 
 def extract_vendor_name(inference_result: Dict) -> Optional[str]:
     """Extract vendor name from BDA inference result"""
@@ -181,6 +1238,10 @@ def extract_vendor_name(inference_result: Dict) -> Optional[str]:
         'seller', 'vendor', 'supplier', 'invoice_from', 'billed_by', 'remit_to'
     ]
     
+    return _extract_field(inference_result, vendor_fields)
+
+def _extract_field(inference_result: Dict, fields: List[str]) -> Optional[str]:
+    """First non-empty value among the given fields, checking direct then nested fields"""
     def get_field_value(field_data):
         """Extract value from various field formats"""
         if isinstance(field_data, str):
@@ -193,7 +1254,7 @@ def extract_vendor_name(inference_result: Dict) -> Optional[str]:
         return None
     
     # Check direct fields
-    for field in vendor_fields:
+    for field in fields:
         if field in inference_result:
             value = get_field_value(inference_result[field])
             if value:
@@ -201,7 +1262,7 @@ def extract_vendor_name(inference_result: Dict) -> Optional[str]:
     
     # Check nested fields
     if 'fields' in inference_result:
-        for field in vendor_fields:
+        for field in fields:
             if field in inference_result['fields']:
                 value = get_field_value(inference_result['fields'][field])
                 if value:
@@ -209,10 +1270,120 @@ def extract_vendor_name(inference_result: Dict) -> Optional[str]:
     
     return None
 
+def extract_supplier_identifiers(inference_result: Dict) -> Dict[str, str]:
+    """Supplier code and registration number from a BDA inference result, keyed by exact index name"""
+    if not inference_result:
+        return {}
+    
+    identifiers = {}
+    for index_name, fields in EXACT_INDEX_FIELDS.items():
+        value = _extract_field(inference_result, fields)
+        if value:
+            identifiers[index_name] = value
+    return identifiers
+
+def match_vendor(matcher: SupplierMatcher, vendor_name: str, include_distribution: bool = False,
+                 deadline: Optional[float] = None) -> Dict:
+    """Best match and top matches for a single vendor name"""
+    return match_vendor_names(matcher, [vendor_name], include_distribution, deadline)[vendor_name]
+
+def match_vendor_names(matcher: SupplierMatcher, vendor_names: List[str],
+                       include_distribution: bool = False, deadline: Optional[float] = None) -> Dict[str, Dict]:
+    """Best match and top matches for each vendor name, scored together in one pass"""
+    matches = matcher.match_all(vendor_names, include_distribution=include_distribution, deadline=deadline)
+    return {
+        vendor_name: {
+            'vendor': vendor_name,  # Changed from vendor_name to vendor to match blueprint
+            **match
+        }
+        for vendor_name, match in zip(vendor_names, matches)
+    }
+
+def enhance_bda_result(matcher: SupplierMatcher, bda_result: Dict, fallback_vendor: str = '',
+                       vendor_matches: Optional[Dict[str, Dict]] = None, deadline: Optional[float] = None) -> Dict:
+    """Add supplier matching to a BDA result, reusing precomputed matches when given"""
+    # Extract vendor name from BDA result
+    inference_result = bda_result.get('inference_result', {})
+    vendor_name = extract_vendor_name(inference_result)
+    
+    # If extraction failed, use the vendor supplied with the request as fallback
+    if not vendor_name:
+        vendor_name = fallback_vendor or ''
+    
+    logger.debug("Extracted vendor name from BDA: %s", vendor_name)
+    
+    # A supplier code or registration number on the invoice resolves the supplier without fuzzy scoring;
+    # the vendor name only fills the remaining top_matches slots
+    exact_match = matcher.match_identifiers(extract_supplier_identifiers(inference_result), vendor_name)
+    if exact_match:
+        metrics.count('ExactIndexHits')
+        if vendor_name:
+            match = (vendor_matches or {}).get(vendor_name) or match_vendor(matcher, vendor_name, deadline=deadline)
+            exact_match = matcher.with_alternatives(exact_match, match['top_matches'])
+        bda_result['supplier_match'] = {
+            'vendor_name_extracted': vendor_name,
+            'matched_supplier': exact_match[0],
+            'top_matches': exact_match[1],
+            'match_tier': 'exact'
+        }
+    elif vendor_name:
+        match = (vendor_matches or {}).get(vendor_name) or match_vendor(matcher, vendor_name, deadline=deadline)
+        
+        # Add supplier matching to BDA result
+        bda_result['supplier_match'] = {
+            'vendor_name_extracted': vendor_name,
+            'matched_supplier': match['best_match'],
+            'top_matches': match['top_matches'],
+            'match_tier': match['match_tier']
+        }
+    else:
+        bda_result['supplier_match'] = {
+            'vendor_name_extracted': '',
+            'matched_supplier': None,
+            'top_matches': [],
+            'match_tier': None
+        }
+    
+    return bda_result
+
+def match_vendors_batch(matcher: SupplierMatcher, vendors: List[str], bda_results: List[Dict],
+                        deadline: Optional[float] = None) -> Dict:
+    """Match many vendor names and BDA results against one loaded supplier list"""
+    vendor_names = [str(v).strip() if v else '' for v in vendors]
+    # Results resolved by an exact supplier identifier still use their vendor name to fill top_matches
+    bda_vendor_names = [extract_vendor_name(r.get('inference_result', {})) or '' for r in bda_results]
+    
+    # Month-end batches repeat the same vendors, so score each distinct name only once
+    unique_names = list(dict.fromkeys(name for name in vendor_names + bda_vendor_names if name))
+    vendor_matches = match_vendor_names(matcher, unique_names, deadline=deadline)
+    
+    empty_match = {'best_match': None, 'top_matches': [], 'match_tier': None}
+    results = [
+        {'vendor': name, **vendor_matches.get(name, empty_match)}
+        for name in vendor_names
+    ]
+    enhanced_results = [
+        enhance_bda_result(matcher, bda_result, vendor_matches=vendor_matches, deadline=deadline)
+        for bda_result in bda_results
+    ]
+    
+    return {
+        'results': results,
+        'enhanced_results': enhanced_results,
+        'unique_vendors_matched': len(unique_names),
+        'suppliers_loaded': matcher.supplier_count()
+    }
+
+@metrics.flush_after_invocation
 def lambda_handler(event, context):
     """Lambda handler for supplier matching"""
+    # An optional deadline_ms budget counts from here, so supplier list loading spends it too
+    started = time.monotonic()
+    # Decide once per invocation so a sampled request is logged together with its response
+    log_payloads = LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
     try:
-        logger.info(f"Received event: {json.dumps(event)}")
+        if log_payloads:
+            log_fields(logging.INFO, "Received event", event=event)
         
         # Handle different event formats (direct invocation vs API Gateway)
         if 'body' in event:
@@ -221,11 +1392,9 @@ def lambda_handler(event, context):
                 body = json.loads(event['body'])
             else:
                 body = event['body']
-            logger.info(f"Parsed body from API Gateway: {json.dumps(body)}")
         else:
             # Direct invocation format
             body = event
-            logger.info(f"Direct invocation body: {json.dumps(body)}")
         
         # Get bucket name from multiple sources
         bucket_name = (
@@ -235,11 +1404,40 @@ def lambda_handler(event, context):
             'data-bucket-761018861641-us-east-1'  # Fallback to known bucket
         )
         
-        logger.info(f"Using bucket: {bucket_name}")
+        logger.info("Using bucket: %s", bucket_name)
+        
+        # Business units with their own supplier list select it by key; the registry keeps several loaded
+        supplier_list_key = body.get('supplier_list_key') or SUPPLIER_LIST_KEY
+        if not isinstance(supplier_list_key, str) or not is_supplier_list_key(supplier_list_key):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+                },
+                'body': json.dumps({'error': f'supplier_list_key must be {SUPPLIER_LIST_KEY} or end with /{SUPPLIER_LIST_KEY}'})
+            }
         
-        # Initialize matcher and load suppliers
-        matcher = SupplierMatcher()
-        if not matcher.load_suppliers_from_s3(bucket_name):
+        deadline_ms = body.get('deadline_ms')
+        if deadline_ms is not None and (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float))
+                                        or deadline_ms <= 0):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+                },
+                'body': json.dumps({'error': 'deadline_ms must be a positive number of milliseconds'})
+            }
+        deadline = started + deadline_ms / 1000 if deadline_ms is not None else None
+        
+        # Get matcher from the warm-container registry, loading suppliers if needed
+        matcher = get_supplier_matcher(bucket_name, supplier_list_key)
+        if not matcher:
             logger.error("Failed to load suppliers from S3")
             return {
                 'statusCode': 400,
@@ -251,13 +1449,17 @@ def lambda_handler(event, context):
                 },
                 'body': json.dumps({
                     'error': 'No supplier list found. Please upload SupplierList.csv first.',
-                    'bucket_used': bucket_name
+                    'bucket_used': bucket_name,
+                    'supplier_list_key': supplier_list_key
                 })
             }
         
+        # Snapshot so each response reports only its own match cache hits and misses
+        cache_before = matcher.match_cache.stats()
+        
         # Handle different request types
         request_type = body.get('request_type', 'match_vendor')
-        logger.info(f"Processing request type: {request_type}")
+        logger.info("Processing request type: %s", request_type)
         
         if request_type == 'match_vendor':
             # Single vendor matching
@@ -274,18 +1476,16 @@ def lambda_handler(event, context):
                     'body': json.dumps({'error': 'vendor_name is required'})
                 }
             
-            logger.info(f"Matching vendor: {vendor_name}")
-            best_match = matcher.find_best_match(vendor_name)
-            top_matches = matcher.find_top_matches(vendor_name)
+            logger.debug("Matching vendor: %s", vendor_name)
+            # Optional per-bucket score histogram, computed from the same scan as the matches
+            result = match_vendor(matcher, vendor_name, include_distribution=bool(body.get('include_score_distribution')),
+                                  deadline=deadline)
+            result['suppliers_loaded'] = matcher.supplier_count()
+            matcher.save_aliases(bucket_name, supplier_list_key)
+            result['match_cache'] = matcher.match_cache.stats(cache_before)
             
-            result = {
-                'vendor': vendor_name,  # Changed from vendor_name to vendor to match blueprint
-                'best_match': best_match,
-                'top_matches': top_matches,
-                'suppliers_loaded': len(matcher.suppliers)
-            }
-            
-            logger.info(f"Match result: {result}")
+            if log_payloads:
+                log_fields(logging.INFO, "Match result", result=result)
             
             return {
                 'statusCode': 200,
@@ -313,32 +1513,66 @@ def lambda_handler(event, context):
                     'body': json.dumps({'error': 'bda_result is required'})
                 }
             
-            # Extract vendor name from BDA result
-            vendor_name = extract_vendor_name(bda_result.get('inference_result', {}))
+            bda_result = enhance_bda_result(
+                matcher,
+                bda_result,
+                fallback_vendor=body.get('vendor') or body.get('vendor_name', ''),  # Fallback when extraction fails
+                deadline=deadline
+            )
+            matcher.save_aliases(bucket_name, supplier_list_key)
+            
+            if log_payloads:
+                log_fields(logging.INFO, "Enhanced BDA result", enhanced_result=bda_result)
             
-            # If extraction failed, try to get vendor from request body as fallback
-            if not vendor_name:
-                vendor_name = body.get('vendor') or body.get('vendor_name', '')
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+                    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+                },
+                'body': json.dumps({
+                    'enhanced_result': bda_result,
+                    'match_cache': matcher.match_cache.stats(cache_before)
+                })
+            }
+        
+        elif request_type == 'match_vendors_batch':
+            # Match a whole batch of vendor names and/or BDA results in one request
+            vendors = body.get('vendors') or []
+            bda_results = body.get('bda_results') or []
             
-            logger.info(f"Extracted vendor name from BDA: {vendor_name}")
+            error = None
+            if not isinstance(vendors, list) or not isinstance(bda_results, list):
+                error = 'vendors and bda_results must be lists'
+            elif not vendors and not bda_results:
+                error = 'vendors or bda_results is required'
+            elif len(vendors) + len(bda_results) > MAX_BATCH_SIZE:
+                error = f'Batch too large: at most {MAX_BATCH_SIZE} vendors and BDA results per request'
+            elif not all(isinstance(r, dict) for r in bda_results):
+                error = 'bda_results must contain BDA result objects'
             
-            if vendor_name:
-                best_match = matcher.find_best_match(vendor_name)
-                top_matches = matcher.find_top_matches(vendor_name)
-                
-                # Add supplier matching to BDA result
-                bda_result['supplier_match'] = {
-                    'vendor_name_extracted': vendor_name,
-                    'matched_supplier': best_match,
-                    'top_matches': top_matches
-                }
-            else:
-                bda_result['supplier_match'] = {
-                    'vendor_name_extracted': '',
-                    'matched_supplier': None,
-                    'top_matches': []
+            if error:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+                        'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+                    },
+                    'body': json.dumps({'error': error})
                 }
             
+            logger.info("Batch matching %d vendors and %d BDA results", len(vendors), len(bda_results))
+            result = match_vendors_batch(matcher, vendors, bda_results, deadline=deadline)
+            matcher.save_aliases(bucket_name, supplier_list_key)
+            result['match_cache'] = matcher.match_cache.stats(cache_before)
+            
+            if log_payloads:
+                log_fields(logging.INFO, "Batch match result", result=result)
+            
             return {
                 'statusCode': 200,
                 'headers': {
@@ -347,9 +1581,7 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
                     'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
                 },
-                'body': json.dumps({
-                    'enhanced_result': bda_result
-                })
+                'body': json.dumps(result)
             }
         
         else:
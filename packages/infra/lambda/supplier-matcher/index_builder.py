@@ -0,0 +1,44 @@
+import json
+import traceback
+from index import SupplierMatcher, logger, metrics, s3_client, supplier_index_key
+
+
+@metrics.flush_after_invocation
+def lambda_handler(event, context):
+    """Build the serialized supplier index whenever a supplier list CSV is uploaded"""
+    try:
+        bucket = event['detail']['bucket']['name']
+        key = event['detail']['object']['key']
+        logger.info(f"Building supplier index for s3://{bucket}/{key}")
+        
+        matcher = SupplierMatcher()
+        if not matcher.load_suppliers_from_s3(bucket, key):
+            logger.warning(f"Skipping index build, no usable supplier list at s3://{bucket}/{key}")
+            return {'statusCode': 400, 'body': json.dumps({'error': 'No supplier list to index'})}
+        
+        index_key = supplier_index_key(key)
+        with metrics.stage('IndexSerialize'):
+            index_bytes = matcher.to_index_bytes()
+        with metrics.stage('S3Put'):
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=index_key,
+                Body=index_bytes,
+                ContentType='application/gzip',
+                Metadata={'source-etag': matcher.etag or ''}
+            )
+        
+        logger.info(f"Supplier index for {len(matcher.suppliers)} suppliers written to s3://{bucket}/{index_key}")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'index_key': index_key,
+                'source_etag': matcher.etag,
+                'suppliers_indexed': len(matcher.suppliers)
+            })
+        }
+    
+    except Exception as e:
+        logger.error(f"Error building supplier index: {str(e)}")
+        logger.error(f"Error traceback: {traceback.format_exc()}")
+        return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
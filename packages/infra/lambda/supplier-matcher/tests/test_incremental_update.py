@@ -0,0 +1,254 @@
+import datetime
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('PIPELINE_METRICS_ENABLED', 'false')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The shared metrics module is deployed as a Lambda layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'python', 'pipeline-metrics-layer', 'python'))
+
+import index
+import index_builder
+
+HEADER = "Supplier,Name 1,Name 2,Group 1,Group 2,CR 1,CR 2,AWS Vendor\n"
+WORDS = ['Alpha', 'Beta', 'Gamma', 'Delta', 'Pacific', 'Global', 'Trading', 'Logistics', 'Foods', 'Metals']
+
+
+class StubS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        # Conditional writes behave like S3's, so concurrent alias table merges can be exercised
+        current = self.objects.get(Key)
+        if (IfNoneMatch == '*' and current) or (IfMatch and (not current or current['ETag'] != IfMatch)):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed', 'Message': Key}}, 'PutObject')
+        data = Body.encode('utf-8') if isinstance(Body, str) else Body
+        self.objects[Key] = {
+            'data': data,
+            'ETag': f'"{hashlib.md5(data).hexdigest()}"',
+            'LastModified': datetime.datetime.now(datetime.timezone.utc),
+            'Metadata': dict(Metadata or {})
+        }
+
+    def _object(self, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return self.objects[Key]
+
+    def head_object(self, Bucket, Key):
+        obj = self._object(Key)
+        return {'ETag': obj['ETag'], 'LastModified': obj['LastModified'], 'Metadata': obj['Metadata']}
+
+    def get_object(self, Bucket, Key):
+        obj = self._object(Key)
+        body = StreamingBody(io.BytesIO(obj['data']), len(obj['data']))
+        return {'ETag': obj['ETag'], 'LastModified': obj['LastModified'], 'Metadata': obj['Metadata'], 'Body': body}
+
+
+def supplier_rows(count):
+    rows = {}
+    for i in range(count):
+        name = f"{WORDS[i % 10]} {WORDS[i // 10 % 10]} {WORDS[i // 100 % 10]} {i}"
+        rows[f"S{i:04d}"] = [name, 'Ltd', 'G1', '', f"CR-{i:04d}", '', f"{WORDS[i % 3]} Vendor"]
+    return rows
+
+
+def supplier_csv(rows):
+    return HEADER + ''.join(f"{code},{','.join(values)}\n" for code, values in rows.items())
+
+
+def fresh_matcher(s3, rows):
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(rows))
+    matcher = index.SupplierMatcher()
+    assert matcher.load_suppliers_from_s3('bucket', 'SupplierList.csv')
+    return matcher
+
+
+def patch(matcher, s3, rows):
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(rows))
+    return matcher.update_suppliers_from_s3('bucket', 'SupplierList.csv')
+
+
+def exact_codes(matcher):
+    # Exact index contents as index name -> key -> supplier codes, independent of row numbers
+    codes = matcher.suppliers.columns['supplier_code']
+    return {
+        index_name: {key: sorted(codes[row] for row in (rows if isinstance(rows, list) else [rows]))
+                     for key, rows in exact_index.items()}
+        for index_name, exact_index in matcher.exact_indexes.items()
+    }
+
+
+def trigram_codes(matcher):
+    codes = matcher.suppliers.columns['supplier_code']
+    postings = {gram: sorted(codes[row] for row in rows) for gram, rows in matcher.trigram_index.items()}
+    return {gram: rows for gram, rows in postings.items() if rows}
+
+
+def match_summary(matcher, queries):
+    return [
+        ((result['best_match'] or {}).get('supplier_code'), (result['best_match'] or {}).get('similarity_score'),
+         [(m['supplier_code'], m['similarity_score']) for m in result['top_matches']])
+        for result in matcher.match_all(queries)
+    ]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    stub = StubS3()
+    monkeypatch.setattr(index, 's3_client', stub)
+    return stub
+
+
+@pytest.mark.parametrize('pruning_min_suppliers', [50, 10000], ids=['trigram-index', 'full-scan'])
+def test_patched_matcher_matches_fresh_rebuild(s3, monkeypatch, pruning_min_suppliers):
+    monkeypatch.setattr(index, 'CANDIDATE_PRUNING_MIN_SUPPLIERS', pruning_min_suppliers)
+    rows = supplier_rows(200)
+    matcher = fresh_matcher(s3, rows)
+    assert bool(matcher.trigram_index) == (pruning_min_suppliers == 50)
+
+    new_rows = dict(rows)
+    for code in ['S0003', 'S0050', 'S0117']:
+        del new_rows[code]
+    new_rows['S0010'] = ['Harbour Freight Services', '', 'G1', '', 'CR-0010', '', 'Harbour Vendor']
+    new_rows['S0020'] = [rows['S0020'][0], 'Ltd', 'G2', '', 'CR-9020', '', rows['S0020'][6]]
+    new_rows['N0001'] = ['Brand New Supplier', 'GmbH', 'G1', '', 'CR-N0001', '', 'New Vendor']
+
+    assert patch(matcher, s3, new_rows)
+    assert matcher.version == 1
+    fresh = index.SupplierMatcher()
+    assert fresh.load_suppliers_from_s3('bucket', 'SupplierList.csv')
+
+    assert matcher.supplier_count() == fresh.supplier_count() == len(new_rows)
+    assert exact_codes(matcher) == exact_codes(fresh)
+    assert trigram_codes(matcher) == trigram_codes(fresh)
+    queries = [rows['S0003'][0], 'Harbour Freight', 'Brand New Supplier GmbH', rows['S0020'][0], 'Alpha Beta Trading']
+    assert match_summary(matcher, queries) == match_summary(fresh, queries)
+
+
+def test_changed_identifiers_move_in_exact_indexes(s3):
+    rows = supplier_rows(20)
+    matcher = fresh_matcher(s3, rows)
+    assert matcher.match_identifiers({'cr_number': 'CR-0007'})[0]['supplier_code'] == 'S0007'
+
+    new_rows = dict(rows)
+    new_rows['S0007'] = [rows['S0007'][0], 'Ltd', 'G1', '', 'CR-7777', 'CR-7778', rows['S0007'][6]]
+    assert patch(matcher, s3, new_rows)
+
+    assert matcher.match_identifiers({'cr_number': 'CR-0007'}) is None
+    assert matcher.match_identifiers({'cr_number': 'cr 7777'})[0]['supplier_code'] == 'S0007'
+    assert matcher.match_identifiers({'cr_number': 'CR-7778'})[0]['supplier_code'] == 'S0007'
+
+    # A removed supplier drops out of every exact index
+    del new_rows['S0007']
+    assert patch(matcher, s3, new_rows)
+    assert matcher.match_identifiers({'cr_number': 'CR-7777'}) is None
+    assert matcher.match_identifiers({'supplier_code': 'S0007'}) is None
+
+
+def test_duplicate_codes_fall_back_to_rebuild(s3):
+    rows = supplier_rows(20)
+    matcher = fresh_matcher(s3, rows)
+
+    csv_with_duplicate = supplier_csv(rows) + f"S0001,{','.join(rows['S0002'])}\n"
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=csv_with_duplicate)
+
+    assert not matcher.update_suppliers_from_s3('bucket', 'SupplierList.csv')
+    assert matcher.version == 0
+
+
+def test_large_change_falls_back_to_rebuild(s3, monkeypatch):
+    monkeypatch.setattr(index, 'SUPPLIER_INCREMENTAL_MAX_CHANGE_FRACTION', 0.2)
+    rows = supplier_rows(50)
+    matcher = fresh_matcher(s3, rows)
+
+    new_rows = {code: [f"{values[0]} Renamed", *values[1:]] for code, values in rows.items()}
+    assert not patch(matcher, s3, new_rows)
+
+    # Removals accumulate as tombstones, so many small updates eventually force a rebuild too
+    new_rows = dict(rows)
+    for code in list(rows)[:8]:
+        del new_rows[code]
+    assert patch(matcher, s3, new_rows)
+    for code in list(rows)[8:12]:
+        del new_rows[code]
+    assert not patch(matcher, s3, new_rows)
+
+
+def test_crossing_pruning_size_falls_back_to_rebuild(s3, monkeypatch):
+    monkeypatch.setattr(index, 'CANDIDATE_PRUNING_MIN_SUPPLIERS', 100)
+    rows = supplier_rows(99)
+    matcher = fresh_matcher(s3, rows)
+    assert not matcher.trigram_index
+
+    new_rows = {**rows, 'N0001': ['Brand New Supplier', '', 'G1', '', '', '', '']}
+    assert not patch(matcher, s3, new_rows)
+
+
+def test_get_supplier_matcher_patches_in_place_or_rebuilds(s3, monkeypatch):
+    monkeypatch.setattr(index, 'SUPPLIER_CACHE_MAX_STALENESS_SECONDS', 0)
+    monkeypatch.setattr(index, '_matcher_registry', index.MatcherRegistry())
+    rows = supplier_rows(50)
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(rows))
+    matcher = index.get_supplier_matcher('bucket')
+
+    small_change = {**rows, 'N0001': ['Brand New Supplier', '', 'G1', '', '', '', '']}
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(small_change))
+    assert index.get_supplier_matcher('bucket') is matcher
+    assert matcher.version == 1
+
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(supplier_rows(10)))
+    rebuilt = index.get_supplier_matcher('bucket')
+    assert rebuilt is not matcher
+    assert rebuilt.supplier_count() == 10
+
+
+def test_changed_list_loads_a_current_prebuilt_index_instead_of_patching(s3, monkeypatch):
+    monkeypatch.setattr(index, 'SUPPLIER_CACHE_MAX_STALENESS_SECONDS', 0)
+    monkeypatch.setattr(index, '_matcher_registry', index.MatcherRegistry())
+    rows = supplier_rows(50)
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(rows))
+    matcher = index.get_supplier_matcher('bucket')
+
+    small_change = {**rows, 'N0001': ['Brand New Supplier', '', 'G1', '', '', '', '']}
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(small_change))
+    monkeypatch.setattr(index_builder, 's3_client', s3)
+    index_builder.lambda_handler(
+        {'detail': {'bucket': {'name': 'bucket'}, 'object': {'key': 'SupplierList.csv'}}}, None)
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError('the CSV should not be parsed when the prebuilt index is current')
+    monkeypatch.setattr(index.SupplierMatcher, 'update_suppliers_from_s3', unexpected)
+    monkeypatch.setattr(index.SupplierMatcher, 'load_suppliers_from_s3', unexpected)
+
+    reloaded = index.get_supplier_matcher('bucket')
+    assert reloaded is not matcher
+    assert reloaded.supplier_count() == 51
+    assert reloaded.match_identifiers({'supplier_code': 'N0001'})[0]['supplier_code'] == 'N0001'
+
+
+def test_failed_revalidation_serves_the_loaded_list(s3, monkeypatch):
+    monkeypatch.setattr(index, 'SUPPLIER_CACHE_MAX_STALENESS_SECONDS', 0)
+    monkeypatch.setattr(index, '_matcher_registry', index.MatcherRegistry())
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(supplier_rows(20)))
+    matcher = index.get_supplier_matcher('bucket')
+
+    def unavailable(**kwargs):
+        raise ConnectionError('S3 unavailable')
+    monkeypatch.setattr(s3, 'head_object', unavailable)
+    monkeypatch.setattr(s3, 'get_object', unavailable)
+
+    assert index.get_supplier_matcher('bucket') is matcher
@@ -0,0 +1,102 @@
+import json
+import time
+
+import pytest
+
+import index
+from test_incremental_update import fresh_matcher, s3, supplier_csv, supplier_rows  # noqa: F401
+
+
+def codes(top_matches):
+    return [m['supplier_code'] for m in top_matches]
+
+
+def test_exact_hits_fill_top_matches_from_the_fuzzy_pass(s3):
+    rows = supplier_rows(200)
+    matcher = fresh_matcher(s3, rows)
+    name = f"{rows['S0123'][0]} {rows['S0123'][1]}"
+
+    result = matcher.match_all([name])[0]
+    # A distribution bypasses the exact indexes, so this is what a plain fuzzy scan returns
+    scanned = matcher.match_all([name], include_distribution=True)[0]
+
+    assert result['match_tier'] == 'exact'
+    assert result['best_match']['supplier_code'] == 'S0123'
+    assert [m['match_type'] for m in result['top_matches']] == ['exact', 'fuzzy', 'fuzzy']
+    assert codes(result['top_matches']) == codes(scanned['top_matches'])
+
+
+def test_identifier_hits_fill_top_matches_from_the_vendor_name(s3):
+    rows = supplier_rows(200)
+    matcher = fresh_matcher(s3, rows)
+    bda_result = {'inference_result': {'Vendor': 'Delta Gamma Beta 1234', 'CR_NUMBER': 'CR-0132'}}
+
+    supplier_match = index.enhance_bda_result(matcher, bda_result)['supplier_match']
+
+    assert supplier_match['match_tier'] == 'exact'
+    assert supplier_match['matched_supplier']['supplier_code'] == 'S0132'
+    assert codes(supplier_match['top_matches']) == ['S0132', 'S0123', 'S0112']
+
+
+def test_passed_deadline_leaves_only_unscored_vendors_unresolved(s3):
+    rows = supplier_rows(200)
+    matcher = fresh_matcher(s3, rows)
+    exact_name = f"{rows['S0123'][0]} {rows['S0123'][1]}"
+    matcher.match_all(['Delta Gamma Beta 1234'])
+    cached_entries = len(matcher.match_cache)
+
+    results = matcher.match_all([exact_name, 'Delta Gamma Beta 1234', 'Pacific Alpha Beta 1045'],
+                                deadline=time.monotonic() - 1)
+
+    # Exact and cached answers need no scoring; the vendor that did is left unresolved and uncached
+    assert [r['match_tier'] for r in results] == ['exact', 'cache', None]
+    assert results[0]['best_match']['supplier_code'] == 'S0123'
+    assert results[2]['best_match'] is None and results[2]['top_matches'] == []
+    assert len(matcher.match_cache) == cached_entries
+
+
+def test_deadline_during_full_scan_recheck_keeps_the_pruned_result(s3, monkeypatch):
+    monkeypatch.setattr(index, 'CANDIDATE_PRUNING_MIN_SUPPLIERS', 50)
+    # No pruned result is confident, so every vendor is re-checked against the full list
+    monkeypatch.setattr(index, 'CANDIDATE_CONFIDENT_SCORE', 101)
+    matcher = fresh_matcher(s3, supplier_rows(200))
+
+    # The clock passes the deadline while the pruned candidates are scored
+    now = [0.0]
+    monkeypatch.setattr(index.time, 'monotonic', lambda: now[0])
+    score_matrix = matcher._score_matrix
+
+    def slow_score_matrix(*args, **kwargs):
+        now[0] += 10
+        return score_matrix(*args, **kwargs)
+    monkeypatch.setattr(matcher, '_score_matrix', slow_score_matrix)
+
+    result = matcher.match_all(['Delta Gamma Beta 1234'], deadline=5)[0]
+
+    assert result['match_tier'] == 'pruned'
+    assert result['best_match']['supplier_code'] == 'S0123'
+    assert len(matcher.match_cache) == 0
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'supplier_list_key': '../other/list.csv'}, 'supplier_list_key must be'),
+    ({'supplier_list_key': 42}, 'supplier_list_key must be'),
+    ({'deadline_ms': 0}, 'deadline_ms must be'),
+    ({'deadline_ms': True}, 'deadline_ms must be'),
+])
+def test_invalid_request_parameters_are_rejected(s3, body, error):
+    response = index.lambda_handler({'bucket_name': 'bucket', 'vendor': 'Alpha Beta', **body}, None)
+
+    assert response['statusCode'] == 400
+    assert json.loads(response['body'])['error'].startswith(error)
+
+
+def test_business_unit_list_is_selected_by_key(s3, monkeypatch):
+    monkeypatch.setattr(index, '_matcher_registry', index.MatcherRegistry())
+    s3.put_object(Bucket='bucket', Key='unit-a/SupplierList.csv', Body=supplier_csv(supplier_rows(20)))
+
+    response = index.lambda_handler({'bucket_name': 'bucket', 'vendor': 'Alpha Beta',
+                                     'supplier_list_key': 'unit-a/SupplierList.csv'}, None)
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['suppliers_loaded'] == 20
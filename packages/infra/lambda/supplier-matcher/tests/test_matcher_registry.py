@@ -0,0 +1,71 @@
+import index
+from test_incremental_update import s3, supplier_csv, supplier_rows  # noqa: F401
+
+
+class SizedMatcher:
+    # Just what the registry reads from a matcher
+    def __init__(self, etag, size_bytes):
+        self.etag = etag
+        self.size_bytes = size_bytes
+
+    def memory_bytes(self):
+        return self.size_bytes
+
+
+def loaded_keys(registry):
+    return [key for _, key, _ in registry.entries]
+
+
+def test_least_recently_used_list_is_evicted_first():
+    registry = index.MatcherRegistry(max_bytes=300)
+    for key in ['a', 'b', 'c']:
+        registry.put('bucket', key, SizedMatcher(f'etag-{key}', 100), 0)
+
+    assert registry.get('bucket', 'a')['matcher'].etag == 'etag-a'
+    registry.put('bucket', 'd', SizedMatcher('etag-d', 100), 0)
+
+    assert loaded_keys(registry) == ['c', 'a', 'd']
+    assert registry.get('bucket', 'b') is None
+
+
+def test_eviction_continues_until_the_budget_fits():
+    registry = index.MatcherRegistry(max_bytes=300)
+    for key in ['a', 'b', 'c']:
+        registry.put('bucket', key, SizedMatcher(f'etag-{key}', 100), 0)
+
+    registry.put('bucket', 'd', SizedMatcher('etag-d', 250), 0)
+
+    assert loaded_keys(registry) == ['d']
+    assert registry.total_bytes() == 250
+
+
+def test_list_larger_than_the_budget_is_still_served():
+    registry = index.MatcherRegistry(max_bytes=300)
+    registry.put('bucket', 'a', SizedMatcher('etag-a', 100), 0)
+
+    registry.put('bucket', 'huge', SizedMatcher('etag-huge', 500), 0)
+
+    # Everything else goes, but the list that was just asked for stays loaded
+    assert loaded_keys(registry) == ['huge']
+    assert registry.get('bucket', 'huge')['matcher'].etag == 'etag-huge'
+
+
+def test_incremental_update_rekeys_the_registry_entry(s3, monkeypatch):
+    monkeypatch.setattr(index, 'SUPPLIER_CACHE_MAX_STALENESS_SECONDS', 0)
+    registry = index.MatcherRegistry()
+    monkeypatch.setattr(index, '_matcher_registry', registry)
+    rows = supplier_rows(50)
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv', Body=supplier_csv(rows))
+    matcher = index.get_supplier_matcher('bucket')
+    old_etag = matcher.etag
+
+    s3.put_object(Bucket='bucket', Key='SupplierList.csv',
+                  Body=supplier_csv({**rows, 'N0001': ['Brand New Supplier', '', 'G1', '', '', '', '']}))
+    assert index.get_supplier_matcher('bucket') is matcher
+    assert matcher.version == 1
+
+    # One entry, under the patched version, so the next lookup finds it without reloading
+    assert list(registry.entries) == [('bucket', 'SupplierList.csv', matcher.etag)]
+    assert matcher.etag != old_etag
+    assert registry.versions == {('bucket', 'SupplierList.csv'): matcher.etag}
+    assert registry.get('bucket', 'SupplierList.csv')['matcher'] is matcher
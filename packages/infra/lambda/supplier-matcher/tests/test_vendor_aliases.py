@@ -0,0 +1,108 @@
+import json
+
+import index
+from test_incremental_update import StubS3, fresh_matcher, s3, supplier_csv, supplier_rows  # noqa: F401
+
+QUERY = 'Delta Gamma Beta 1234'
+
+
+def top_matches(result):
+    return [(m['supplier_code'], m['similarity_score']) for m in result['top_matches']]
+
+
+def test_alias_hit_returns_the_scored_top_matches(s3, monkeypatch):
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_MIN_SCORE', 85)
+    matcher = fresh_matcher(s3, supplier_rows(200))
+
+    scored = matcher.match_all([QUERY])[0]
+    assert scored['match_tier'] == 'full' and len(scored['top_matches']) == 3
+    assert matcher.save_aliases('bucket', 'SupplierList.csv', force=True) == 1
+
+    # A fresh instance answers from the shared alias table with the same top list as the scan
+    reloaded = fresh_matcher(s3, supplier_rows(200))
+    assert reloaded.load_aliases_from_s3('bucket', 'SupplierList.csv')
+    alias = reloaded.match_all([QUERY])[0]
+    assert alias['match_tier'] == 'alias'
+    assert alias['best_match']['supplier_code'] == scored['best_match']['supplier_code']
+    assert top_matches(alias) == top_matches(scored)
+    assert top_matches(reloaded.match_all([QUERY], limit=2)[0]) == top_matches(scored)[:2]
+
+    # A request for more matches, or lower-scoring ones, than the alias learned is scored instead
+    assert reloaded.match_all([QUERY], limit=5)[0]['match_tier'] == 'full'
+    assert reloaded.match_all([QUERY], top_threshold=30)[0]['match_tier'] == 'full'
+
+
+def test_learned_aliases_are_saved_in_batches(s3, monkeypatch):
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_MIN_SCORE', 85)
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_FLUSH_MIN_PENDING', 2)
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_FLUSH_INTERVAL_SECONDS', 3600)
+    matcher = fresh_matcher(s3, supplier_rows(200))
+    alias_key = index.supplier_alias_key('SupplierList.csv')
+
+    matcher.match_all([QUERY])
+    assert matcher.save_aliases('bucket', 'SupplierList.csv') == 0
+    assert alias_key not in s3.objects
+
+    matcher.match_all(['Pacific Alpha Beta 1045'])
+    assert matcher.save_aliases('bucket', 'SupplierList.csv') == 2
+    assert len(json.loads(s3.objects[alias_key]['data'])['aliases']) == 2
+
+    # Once the oldest pending alias has waited long enough it is saved on its own
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_FLUSH_INTERVAL_SECONDS', 0)
+    matcher.match_all(['Trading Global Beta 1567'])
+    assert matcher.save_aliases('bucket', 'SupplierList.csv') == 1
+
+
+def saved_aliases(s3):
+    return json.loads(s3.objects[index.supplier_alias_key('SupplierList.csv')]['data'])['aliases']
+
+
+def test_concurrent_alias_saves_are_merged(s3, monkeypatch):
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_MIN_SCORE', 85)
+    first = fresh_matcher(s3, supplier_rows(200))
+    second = fresh_matcher(s3, supplier_rows(200))
+    first.match_all([QUERY])
+    second.match_all(['Pacific Alpha Beta 1045'])
+
+    # Another instance saves between this instance's read and its conditional write
+    read_alias_table = second._read_alias_table
+    interleaved = []
+
+    def read_then_interleave(bucket, alias_key):
+        table = read_alias_table(bucket, alias_key)
+        if not interleaved:
+            interleaved.append(first.save_aliases('bucket', 'SupplierList.csv', force=True))
+        return table
+    monkeypatch.setattr(second, '_read_alias_table', read_then_interleave)
+
+    assert second.save_aliases('bucket', 'SupplierList.csv', force=True) == 1
+    assert interleaved == [1]
+    # The stale write was rejected and retried on top of the other instance's table
+    assert sorted(saved_aliases(s3)) == sorted([index.normalize_company_name(QUERY),
+                                                index.normalize_company_name('Pacific Alpha Beta 1045')])
+    assert index.normalize_company_name(QUERY) in second.aliases
+
+
+def test_alias_save_gives_up_after_repeated_conflicts(s3, monkeypatch):
+    monkeypatch.setattr(index, 'VENDOR_ALIAS_MIN_SCORE', 85)
+    matcher = fresh_matcher(s3, supplier_rows(200))
+    matcher.match_all([QUERY])
+    alias_key = index.supplier_alias_key('SupplierList.csv')
+    read_alias_table = matcher._read_alias_table
+    conflicts = []
+
+    def read_then_conflict(bucket, key):
+        # Every read is followed by a different write from elsewhere, so no conditional write can succeed
+        table = read_alias_table(bucket, key)
+        conflicts.append(key)
+        s3.put_object(Bucket='bucket', Key=alias_key, Body=json.dumps({
+            'format_version': index.VENDOR_ALIAS_FORMAT_VERSION,
+            'aliases': {f'other vendor {len(conflicts)}': {'codes': ['S0001'], 'limit': 3, 'top_threshold': 50}}
+        }))
+        return table
+    monkeypatch.setattr(matcher, '_read_alias_table', read_then_conflict)
+
+    assert matcher.save_aliases('bucket', 'SupplierList.csv', force=True) == 0
+    assert len(conflicts) == index.VENDOR_ALIAS_SAVE_ATTEMPTS
+    # Still pending, so the next flush tries again
+    assert index.normalize_company_name(QUERY) in matcher.pending_aliases
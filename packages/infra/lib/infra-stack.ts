@@ -102,7 +102,10 @@ export class InfraStack extends cdk.Stack {
     /* BDA Stack */
     const bdaStack = new BDAStack(this, "bda-stack", {
       ...props,
-      fileBucket: dataBucketStack.dataBucket
+      fileBucket: dataBucketStack.dataBucket,
+      // Set in cdk.json or per deploy, e.g. `cdk deploy -c bdaMaxJobsInFlight=2`
+      bdaSubmitRatePerSecond: Number(this.node.tryGetContext('bdaSubmitRatePerSecond') ?? 2),
+      bdaMaxJobsInFlight: Number(this.node.tryGetContext('bdaMaxJobsInFlight') ?? 4)
     })
 
     NagSuppressions.addStackSuppressions(bdaStack, [{
@@ -1,22 +1,30 @@
 import { Stack, StackProps, Aspects, Duration, aws_events_targets as targets, aws_events as events } from "aws-cdk-lib";
 import { Bucket } from "aws-cdk-lib/aws-s3";
 import { Construct } from "constructs";
+import { createHash } from "crypto";
 import { DataAutomationProject, DataAutomationBlueprint } from "../constructs/bda-construct";
-import { AwsSolutionsChecks } from 'cdk-nag';
+import { AwsSolutionsChecks, NagSuppressions } from 'cdk-nag';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as destinations from 'aws-cdk-lib/aws-lambda-destinations';
+import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
 import * as pythonLambda from '@aws-cdk/aws-lambda-python-alpha';
 import * as iam from 'aws-cdk-lib/aws-iam';
-import * as fs from 'fs';
 import * as BDAConfig from '../config/BDAConfig';
 
 interface BDAStackProps extends StackProps {
     fileBucket: Bucket;
+    // BDA job submissions per second across every invocation of the upload pipeline; 0 disables the limit
+    bdaSubmitRatePerSecond?: number;
+    // BDA jobs the upload pipeline may have running at once; 0 disables the limit
+    bdaMaxJobsInFlight?: number;
 }
   
 export class BDAStack extends Stack {
     public readonly role: iam.Role;
     public readonly fileBucket: Bucket;
     public readonly supplierMatcherFunction: lambda.Function;
+    private readonly pipelineMetricsLayer: lambda.LayerVersion;
 
     constructor(scope: Construct, id: string, props: BDAStackProps) {
         super(scope, id, props);
@@ -52,13 +60,54 @@ export class BDAStack extends Stack {
             throw new Error('Bucket encryption key is required');
         }
         
+        // Shared stage timing and EMF metrics module used by the pipeline Lambdas
+        this.pipelineMetricsLayer = new lambda.LayerVersion(this, 'PipelineMetricsLayer', {
+            code: lambda.Code.fromAsset('lambda/python/pipeline-metrics-layer', {
+                exclude: ['tests', '**/__pycache__'],
+            }),
+            description: 'Pipeline stage timing metrics',
+            compatibleRuntimes: [lambda.Runtime.PYTHON_3_12],
+        });
+
+        // Upload and completion events that still fail after their retries are kept here for redrive
+        const failedEventsQueue = new sqs.Queue(this, 'InvokeDataAutomationFailedEvents', {
+            encryption: sqs.QueueEncryption.SQS_MANAGED,
+            enforceSSL: true,
+            retentionPeriod: Duration.days(14),
+        });
+        NagSuppressions.addResourceSuppressions(failedEventsQueue, [
+            {
+                id: 'AwsSolutions-SQS3',
+                reason: 'This queue is itself the dead-letter queue and on-failure destination of the BDA pipeline'
+            }
+        ]);
+
+        // Uploads wait here until the submission limits have room; the function requeues them with a delay
+        // while every job slot is taken, so only real failures count towards the redrive
+        const documentUploadQueue = new sqs.Queue(this, 'DocumentUploadQueue', {
+            encryption: sqs.QueueEncryption.SQS_MANAGED,
+            enforceSSL: true,
+            // Six times the function timeout, as recommended for Lambda event sources
+            visibilityTimeout: Duration.minutes(30),
+            deadLetterQueue: { queue: failedEventsQueue, maxReceiveCount: 3 },
+        });
+
         // Create EventBridge rules for specific prefixes
         const invokeDataAutomationLambdaFunction = this.createInvokeDataAutomationFunction({
+            failedEventsQueue,
+            documentUploadQueue,
+            submitRatePerSecond: props.bdaSubmitRatePerSecond ?? 2,
+            maxJobsInFlight: props.bdaMaxJobsInFlight ?? 4,
             targetBucketName: this.fileBucket.bucketName,
             accountId: this.account,
             dataProjectArn: project.projectARN,
             targetBucketKey: this.fileBucket.encryptionKey!.keyArn,
-            customBlueprintArn: customBlueprint.blueprintARN
+            customBlueprintArn: customBlueprint.blueprintARN,
+            // Changes with the deployed schema, so the job ledger stops reusing results produced by the old one
+            customBlueprintVersion: createHash('sha256')
+                .update(BDAConfig.customBlueprint["ComprehensiveInvoice"])
+                .digest('hex')
+                .slice(0, 16)
         });
       
         const rule = new events.Rule(this, 'DocumentsRule', {
@@ -71,23 +120,60 @@ export class BDAStack extends Stack {
                 },
             },
         });
-        rule.addTarget(new targets.LambdaFunction(invokeDataAutomationLambdaFunction));
+        rule.addTarget(new targets.SqsQueue(documentUploadQueue));
+
+        // Process BDA output when the job finishes instead of polling inside the invocation
+        const bdaCompletionRule = new events.Rule(this, 'BDACompletionRule', {
+            eventPattern: {
+                source: ['aws.bedrock'],
+                detailType: [
+                    'Bedrock Data Automation Job Succeeded',
+                    'Bedrock Data Automation Job Failed With Client Error',
+                    'Bedrock Data Automation Job Failed With Service Error'
+                ],
+            },
+        });
+        bdaCompletionRule.addTarget(new targets.LambdaFunction(invokeDataAutomationLambdaFunction));
 
         // Create Supplier Matcher Lambda Function
         this.supplierMatcherFunction = this.createSupplierMatcherFunction({
             targetBucketName: this.fileBucket.bucketName,
             targetBucketKey: this.fileBucket.encryptionKey!.keyArn
         });
+
+        // Rebuild the prebuilt supplier index whenever a new supplier list is uploaded
+        const supplierIndexBuilderFunction = this.createSupplierIndexBuilderFunction({
+            targetBucketName: this.fileBucket.bucketName,
+            targetBucketKey: this.fileBucket.encryptionKey!.keyArn
+        });
+
+        const supplierListRule = new events.Rule(this, 'SupplierListRule', {
+            eventPattern: {
+                source: ['aws.s3'],
+                detailType: ['Object Created'],
+                detail: {
+                    bucket: { name: [this.fileBucket.bucketName] },
+                    // The shared list at the bucket root, or one per business unit under its own prefix
+                    object: { key: ['SupplierList.csv', { wildcard: '*/SupplierList.csv' }] },
+                },
+            },
+        });
+        supplierListRule.addTarget(new targets.LambdaFunction(supplierIndexBuilderFunction));
         
 
     }
   
     private createInvokeDataAutomationFunction(params: {
+        failedEventsQueue: sqs.Queue;
+        documentUploadQueue: sqs.Queue;
+        submitRatePerSecond: number;
+        maxJobsInFlight: number;
         targetBucketName: string;
         accountId: string;
         dataProjectArn?: string;
         targetBucketKey?: string;
         customBlueprintArn?: string;
+        customBlueprintVersion?: string;
     }): lambda.Function {
   
         const layer_boto3 = new lambda.LayerVersion(this, 'LatestBoto3Layer', {
@@ -111,10 +197,16 @@ export class BDAStack extends Stack {
           'invoke_data_automation',
           {
             runtime: lambda.Runtime.PYTHON_3_12,
-            handler: 'index.lambda_handler',
-            code: new lambda.InlineCode(fs.readFileSync('lambda/python/bda-load-lambda/index_bda_call.py', { encoding: 'utf-8' })),
+            handler: 'index_bda_call.lambda_handler',
+            code: lambda.Code.fromAsset('lambda/python/bda-load-lambda', {
+                exclude: ['tests', 'backfill.py', '**/__pycache__'],
+            }),
             timeout: Duration.seconds(300),
-            layers: [layer_boto3],
+            // Completion events that keep failing, or wait longer than maxEventAge, go to the failed-events queue
+            retryAttempts: 2,
+            maxEventAge: Duration.hours(6),
+            onFailure: new destinations.SqsDestination(params.failedEventsQueue),
+            layers: [layer_boto3, this.pipelineMetricsLayer],
             environment: {
               TARGET_BUCKET_NAME: params.targetBucketName,
               ACCOUNT_ID: this.account,
@@ -124,9 +216,33 @@ export class BDAStack extends Stack {
               ...(params.customBlueprintArn && {
                 CUSTOM_BLUEPRINT_ARN: params.customBlueprintArn,
               }),
+              ...(params.customBlueprintVersion && {
+                CUSTOM_BLUEPRINT_VERSION: params.customBlueprintVersion,
+              }),
+              BDA_LEDGER_PREFIX: 'bda-ledger/',
+              // Above the 300s function timeout, so only claims whose invocation died are taken over
+              BDA_LEDGER_SUBMIT_GRACE_SECONDS: '600',
+              BDA_SUBMIT_RETRY_DEADLINE_SECONDS: '60',
+              // Enforced through a shared state object next to the job ledger, so they hold across every
+              // concurrent invocation rather than per execution environment
+              BDA_SUBMIT_RATE_PER_SECOND: String(params.submitRatePerSecond),
+              BDA_MAX_JOBS_IN_FLIGHT: String(params.maxJobsInFlight),
+              UPLOAD_QUEUE_URL: params.documentUploadQueue.queueUrl,
             },
           }
         );
+
+        // One upload per invocation; maxConcurrency keeps waiting uploads from scaling the function out
+        // beyond the job limit, and its floor of 2 is the event source minimum
+        lendingDocumentAutomationLambdaFunction.addEventSource(new SqsEventSource(params.documentUploadQueue, {
+            batchSize: 1,
+            reportBatchItemFailures: true,
+            ...(params.maxJobsInFlight > 0 && {
+                maxConcurrency: Math.max(2, params.maxJobsInFlight),
+            }),
+        }));
+        // Requeueing a deferred upload sends a delayed copy of its message
+        params.documentUploadQueue.grantSendMessages(lendingDocumentAutomationLambdaFunction);
     
         lendingDocumentAutomationLambdaFunction.addToRolePolicy(
           new iam.PolicyStatement({
@@ -183,12 +299,19 @@ export class BDAStack extends Stack {
             runtime: lambda.Runtime.PYTHON_3_12,
             handler: 'lambda_handler',
             entry: './lambda/supplier-matcher',
+            bundling: { assetExcludes: ['tests'] },
             timeout: Duration.minutes(5),
             memorySize: 512,
+            layers: [this.pipelineMetricsLayer],
             environment: {
-                BUCKET_NAME: params.targetBucketName
+                BUCKET_NAME: params.targetBucketName,
+                SUPPLIER_CACHE_MAX_STALENESS_SECONDS: '30',
+                SUPPLIER_REGISTRY_MAX_MB: '256',
+                LOG_LEVEL: 'INFO',
+                LOG_PAYLOAD_SAMPLE_RATE: '0',
+                VENDOR_ALIAS_MIN_SCORE: '95'
             },
-            description: 'Supplier matching using thefuzz library'
+            description: 'Supplier matching using the rapidfuzz library'
         });
 
         // Add S3 permissions
@@ -205,11 +328,25 @@ export class BDAStack extends Stack {
             })
         );
 
+        // Learned vendor aliases are the only object the matcher writes
+        supplierMatcherFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: [
+                    's3:PutObject'
+                ],
+                resources: [
+                    `arn:aws:s3:::${params.targetBucketName}/SupplierList.aliases.json`,
+                    `arn:aws:s3:::${params.targetBucketName}/*/SupplierList.aliases.json`
+                ],
+            })
+        );
+
         // Add KMS permissions
         supplierMatcherFunction.addToRolePolicy(
             new iam.PolicyStatement({
                 actions: [
                     'kms:Decrypt',
+                    'kms:GenerateDataKey',
                     'kms:DescribeKey'
                 ],
                 resources: [`${params.targetBucketKey}`],
@@ -218,4 +355,54 @@ export class BDAStack extends Stack {
 
         return supplierMatcherFunction;
     }
+
+    private createSupplierIndexBuilderFunction(params: {
+        targetBucketName: string;
+        targetBucketKey: string;
+    }): lambda.Function {
+
+        // Shares the supplier matcher code, serializing the parsed list into SupplierList.index.json.gz
+        const supplierIndexBuilderFunction = new pythonLambda.PythonFunction(this, 'supplier-index-builder', {
+            runtime: lambda.Runtime.PYTHON_3_12,
+            index: 'index_builder.py',
+            handler: 'lambda_handler',
+            entry: './lambda/supplier-matcher',
+            bundling: { assetExcludes: ['tests'] },
+            timeout: Duration.minutes(5),
+            memorySize: 1024,
+            layers: [this.pipelineMetricsLayer],
+            environment: {
+                BUCKET_NAME: params.targetBucketName,
+                PIPELINE_METRICS_SERVICE: 'supplier-index-builder'
+            },
+            description: 'Builds the prebuilt supplier index on supplier list upload'
+        });
+
+        supplierIndexBuilderFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: [
+                    's3:GetObject',
+                    's3:PutObject',
+                    's3:ListBucket'
+                ],
+                resources: [
+                    `arn:aws:s3:::${params.targetBucketName}/*`,
+                    `arn:aws:s3:::${params.targetBucketName}`
+                ],
+            })
+        );
+
+        supplierIndexBuilderFunction.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: [
+                    'kms:Decrypt',
+                    'kms:GenerateDataKey',
+                    'kms:DescribeKey'
+                ],
+                resources: [`${params.targetBucketKey}`],
+            })
+        );
+
+        return supplierIndexBuilderFunction;
+    }
 }